@@ -1,35 +1,92 @@
 # admin.py
 import streamlit as st
-import aiosqlite
-import asyncio
+import sqlite3
+import threading
 import os
 from datetime import datetime
+from typing import List, Optional, Tuple
 
-DB_PATH = "ads.db"
+from constants import ITEM_TYPES, LOCATIONS
+from queries import CREATE_AD_GENERATIONS, build_filters, count_query, history_tables, page_query
 
-# Асинхронные функции для Streamlit (обёртка)
-def run_async(coro):
-    return asyncio.run(coro)
+DB_PATH = os.getenv("DB_PATH", "ads.db")
+PAGE_SIZE = 50
+CACHE_TTL = 30  # секунд: новые объявления от бота появятся не позже
 
-async def get_all_ads():
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
-            SELECT id, ad_type, item_type, description, location_key,
-                   contact_type, contact_info, status, created_at
-            FROM ads
-            ORDER BY created_at DESC
-        """)
-        return await cursor.fetchall()
+# === Соединения (одни на весь процесс Streamlit) ===
+class _Connection:
+    """sqlite3-соединение с блокировкой: Streamlit выполняет сессии в разных потоках."""
 
-async def archive_ad_db(ad_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE ads SET status = 'archived' WHERE id = ?", (ad_id,))
-        await db.commit()
-
-async def delete_ad_db(ad_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM ads WHERE id = ?", (ad_id,))
-        await db.commit()
+    def __init__(self, readonly: bool):
+        if readonly:
+            self.conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, check_same_thread=False)
+            self.conn.execute("PRAGMA query_only = ON")
+        else:
+            self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        self.conn.execute("PRAGMA busy_timeout = 5000")
+        if not readonly:
+            # BUMP_GENERATION пишет сюда; на базе до обновления бота таблицы ещё нет
+            with self.conn:
+                self.conn.execute(CREATE_AD_GENERATIONS)
+        self.lock = threading.Lock()
+
+    def fetchall(self, query: str, params: tuple = ()) -> List[Tuple]:
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
+
+    def execute(self, query: str, params: tuple = ()):
+        with self.lock, self.conn:
+            self.conn.execute(query, params)
+
+    def transaction(self, *statements: Tuple[str, tuple]):
+        with self.lock, self.conn:
+            for query, params in statements:
+                self.conn.execute(query, params)
+
+@st.cache_resource
+def read_conn() -> _Connection:
+    return _Connection(readonly=True)
+
+@st.cache_resource
+def write_conn() -> _Connection:
+    return _Connection(readonly=False)
+
+# === Запросы ===
+# SQL собирается в queries.py — его же проверяет database.check_query_plans
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def count_ads(tables: Tuple[str, ...], where: str, params: tuple) -> int:
+    return read_conn().fetchall(*count_query(tables, where, params))[0][0]
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def fetch_page(tables: Tuple[str, ...], where: str, params: tuple, after: Optional[Tuple[str, int]]) -> List[Tuple]:
+    return read_conn().fetchall(*page_query(tables, where, params, after, PAGE_SIZE + 1))
+
+def invalidate():
+    count_ads.clear()
+    fetch_page.clear()
+
+# Бот кэширует выдачи по разделам (result_cache.py) и раз в несколько секунд
+# сверяется с этими счётчиками
+BUMP_GENERATION = """
+    INSERT INTO ad_generations (item_type, location_key, generation)
+    SELECT item_type, location_key, 1 FROM ads WHERE id = ?
+    ON CONFLICT (item_type, location_key) DO UPDATE SET generation = generation + 1
+"""
+
+def archive_ad_db(ad_id: int):
+    write_conn().transaction(
+        (BUMP_GENERATION, (ad_id,)),
+        ("UPDATE ads SET status = 'archived' WHERE id = ?", (ad_id,)),
+    )
+    invalidate()
+
+def delete_ad_db(ad_id: int):
+    write_conn().transaction(
+        (BUMP_GENERATION, (ad_id,)),
+        ("DELETE FROM ads WHERE id = ?", (ad_id,)),
+        ("DELETE FROM ads_archive WHERE id = ?", (ad_id,)),
+    )
+    invalidate()
 
 # === Streamlit UI ===
 st.set_page_config(page_title="FilterWhereIsMy — Админка", layout="wide")
@@ -52,53 +109,79 @@ if not st.session_state.authenticated:
 
 st.success("✅ Добро пожаловать, модератор!")
 
-# Загрузка данных
-ads = run_async(get_all_ads())
+if not os.path.exists(DB_PATH):
+    st.info("📭 Нет объявлений.")
+    st.stop()
 
-if not ads:
+# Фильтры
+col1, col2, col3, col4, col5 = st.columns(5)
+with col1:
+    status_filter = st.selectbox("Статус", ["Все", "active", "archived"], index=0)
+with col2:
+    type_filter = st.selectbox("Тип", ["Все", "found", "lost"], index=0)
+with col3:
+    item_filter = st.selectbox("Предмет", ["Все"] + ITEM_TYPES, index=0)
+with col4:
+    location_filter = st.selectbox("Корпус", ["Все"] + list(LOCATIONS), index=0)
+with col5:
+    dates = st.date_input("Период", value=(), format="DD.MM.YYYY")
+date_from = dates[0] if len(dates) > 0 else None
+date_to = dates[1] if len(dates) > 1 else date_from
+
+where, params = build_filters(status_filter, type_filter, item_filter, location_filter, date_from, date_to)
+tables = history_tables(status_filter)
+
+# При смене фильтров — снова с первой страницы
+if st.session_state.get("filters") != (where, params):
+    st.session_state.filters = (where, params)
+    st.session_state.page_cursors = [None]
+cursors = st.session_state.page_cursors
+
+total = count_ads(tables, where, params)
+if not total:
     st.info("📭 Нет объявлений.")
-else:
-    st.write(f"Всего объявлений: {len(ads)}")
-
-    # Фильтры
-    col1, col2 = st.columns(2)
-    with col1:
-        status_filter = st.selectbox("Статус", ["Все", "active", "archived"], index=0)
-    with col2:
-        type_filter = st.selectbox("Тип", ["Все", "found", "lost"], index=0)
-
-    # Фильтрация
-    filtered = []
-    for ad in ads:
-        ad_id, ad_type, item, desc, loc, c_type, c_info, status, created = ad
-        if status_filter != "Все" and status != status_filter:
-            continue
-        if type_filter != "Все" and ad_type != type_filter:
-            continue
-        filtered.append(ad)
-
-    # Таблица
-    for ad in filtered:
-        ad_id, ad_type, item, desc, loc, c_type, c_info, status, created = ad
-        dt = datetime.fromisoformat(created).strftime("%d.%m %H:%M")
-        emoji = "🔍" if ad_type == "found" else "❓"
-        status_badge = "🟢 active" if status == "active" else "⚫ archived"
-
-        with st.expander(f"{emoji} {item} | {loc} | {status_badge} | {dt}", expanded=False):
-            st.write(f"**Тип:** {ad_type}")
-            st.write(f"**Описание:** {desc or '—'}")
-            st.write(f"**Контакт:** {c_info}")
-            st.write(f"**ID объявления:** `{ad_id}`")
-
-            col_a, col_b = st.columns(2)
-            with col_a:
-                if status == "active":
-                    if st.button("⏹ Архивировать", key=f"arch_{ad_id}"):
-                        run_async(archive_ad_db(ad_id))
-                        st.success(f"Объявление {ad_id} архивировано")
-                        st.rerun()
-            with col_b:
-                if st.button("🗑 Удалить", key=f"del_{ad_id}", type="secondary"):
-                    run_async(delete_ad_db(ad_id))
-                    st.success(f"Объявление {ad_id} удалено")
-                    st.rerun()
\ No newline at end of file
+    st.stop()
+
+rows = fetch_page(tables, where, params, cursors[-1])
+has_next = len(rows) > PAGE_SIZE
+ads = rows[:PAGE_SIZE]
+page = len(cursors)
+st.write(f"Всего объявлений: {total} · страница {page} из {(total + PAGE_SIZE - 1) // PAGE_SIZE}")
+
+# Таблица
+for ad in ads:
+    ad_id, ad_type, item, desc, loc, c_type, c_info, status, created = ad
+    dt = datetime.fromisoformat(created).strftime("%d.%m %H:%M")
+    emoji = "🔍" if ad_type == "found" else "❓"
+    status_badge = "🟢 active" if status == "active" else "⚫ archived"
+
+    with st.expander(f"{emoji} {item} | {loc} | {status_badge} | {dt}", expanded=False):
+        st.write(f"**Тип:** {ad_type}")
+        st.write(f"**Описание:** {desc or '—'}")
+        st.write(f"**Контакт:** {c_info}")
+        st.write(f"**ID объявления:** `{ad_id}`")
+
+        col_a, col_b = st.columns(2)
+        with col_a:
+            if status == "active":
+                if st.button("⏹ Архивировать", key=f"arch_{ad_id}"):
+                    archive_ad_db(ad_id)
+                    st.success(f"Объявление {ad_id} архивировано")
+                    st.rerun()
+        with col_b:
+            if st.button("🗑 Удалить", key=f"del_{ad_id}", type="secondary"):
+                delete_ad_db(ad_id)
+                st.success(f"Объявление {ad_id} удалено")
+                st.rerun()
+
+# Пагинация
+col_prev, col_next = st.columns(2)
+with col_prev:
+    if page > 1 and st.button("← Назад"):
+        cursors.pop()
+        st.rerun()
+with col_next:
+    if has_next and st.button("Дальше →"):
+        last = ads[-1]
+        cursors.append((last[8], last[0]))
+        st.rerun()
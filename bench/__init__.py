@@ -0,0 +1,10 @@
+"""
+Бенчмарки горячих путей бота.
+
+    python -m bench.run --sizes 1000,100000,1000000 --out bench_new.json
+    python -m bench.compare bench_old.json bench_new.json
+
+Каждый прогон создаёт временную БД с синтетическими объявлениями
+(реальные ITEM_TYPES и LOCATIONS, русские описания) и пишет в JSON
+p50/p95/p99, пропускную способность и пиковый RSS по каждому замеру.
+"""
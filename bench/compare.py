@@ -0,0 +1,66 @@
+"""
+Сравнение двух прогонов: python -m bench.compare old.json new.json [--threshold 0.1]
+Код возврата 1, если есть регрессии.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, List, Tuple
+
+
+def iter_metrics(results: Dict, prefix: str = "") -> Iterator[Tuple[str, Dict]]:
+    """Все замеры с перцентилями, с путём вида '100000/create_ad'."""
+    for name, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        path = f"{prefix}{name}"
+        if "p95_ms" in value:
+            yield path, value
+        else:
+            yield from iter_metrics(value, path + "/")
+
+
+def compare(base: Dict, new: Dict, threshold: float) -> List[str]:
+    base_metrics = dict(iter_metrics(base["results"]))
+    regressions = []
+    print(f"{'замер':55} {'p95 было':>10} {'p95 стало':>10} {'изм.':>8}")
+    for path, metric in iter_metrics(new["results"]):
+        old = base_metrics.get(path)
+        if old is None:
+            continue
+        change = metric["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  ⚠️ p95"
+            regressions.append(f"{path}: p95 {old['p95_ms']} → {metric['p95_ms']} мс")
+        old_tp, new_tp = old.get("throughput_per_s"), metric.get("throughput_per_s")
+        if old_tp and new_tp and new_tp < old_tp * (1 - threshold):
+            flag += "  ⚠️ throughput"
+            regressions.append(f"{path}: throughput {old_tp} → {new_tp}/с")
+        print(f"{path:55} {old['p95_ms']:>10} {metric['p95_ms']:>10} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение двух прогонов бенчмарков")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1, help="допустимое ухудшение (0.1 = 10%%)")
+    args = parser.parse_args(argv)
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print("\n❌ Регрессии:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\n✅ Регрессий нет.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Генератор синтетических объявлений для бенчмарков."""
+import random
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from constants import ITEM_TYPES, LOCATIONS
+from embedding_codec import encode_embedding
+
+EMBEDDING_DIM = 384
+
+COLORS = ["чёрный", "синий", "красный", "белый", "серый", "зелёный", "розовый", "бежевый"]
+DETAILS = {
+    "Карту-пропуск": ["в прозрачном чехле", "на синем шнурке", "с наклейкой", "без чехла"],
+    "Гардеробный номерок": ["номер {n}", "пластиковый, номер {n}", "металлический, {n}"],
+    "Ключи": ["связка из {n} ключей", "с брелоком", "с домофонным ключом", "на кольце"],
+    "Повербанк": ["Xiaomi на 10000 мАч", "Anker с кабелем", "маленький, с царапинами"],
+    "Зонтик": ["складной", "трость", "с деревянной ручкой", "в клетку"],
+    "Кошелёк": ["кожаный", "на молнии", "с картами внутри", "тканевый"],
+    "Другое…": ["наушники в кейсе", "тетрадь по матанализу", "шарф", "бутылка для воды", "очки в футляре"],
+}
+PLACES = [
+    "у гардероба", "в аудитории {n}", "в столовой", "на 3 этаже у лифта",
+    "в библиотеке", "у входа", "в коворкинге", "", "",
+]
+DROP_PLACES = ["на посту охраны", "в деканате", "в гардеробе", "в библиотеке"]
+
+
+def random_description(rng: random.Random, item_type: str) -> str:
+    detail = rng.choice(DETAILS[item_type]).format(n=rng.randint(2, 450))
+    return f"{rng.choice(COLORS)}, {detail}" if rng.random() < 0.7 else detail
+
+
+def random_ad(rng: random.Random, user_id: int) -> Tuple:
+    """Поля для create_ad без эмбеддинга: (user_id, ad_type, item_type, ...)."""
+    item_type = rng.choice(ITEM_TYPES)
+    contact_type = rng.choice(["drop", "contact"])
+    contact_info = rng.choice(DROP_PLACES) if contact_type == "drop" else f"@student{rng.randint(1, 99999)}"
+    return (
+        user_id, "found", item_type, random_description(rng, item_type), None,
+        rng.choice(list(LOCATIONS)), rng.choice(PLACES).format(n=rng.randint(100, 520)),
+        contact_type, contact_info,
+    )
+
+
+def random_embeddings(np_rng: np.random.Generator, n: int) -> np.ndarray:
+    """Случайные нормированные векторы той же размерности, что у модели."""
+    vecs = np_rng.standard_normal((n, EMBEDDING_DIM)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs
+
+
+def generate_rows(total: int, chunk: int = 10000, seed: int = 42) -> Iterator[List[Tuple]]:
+    """
+    Пачки готовых строк для INSERT в ads (включая BLOB и created_at).
+    Векторы синтетические: кодировать миллион описаний моделью слишком долго,
+    а для замеров БД и ранжирования важны только размеры.
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    now = datetime.now()
+    done = 0
+    while done < total:
+        n = min(chunk, total - done)
+        vecs = random_embeddings(np_rng, n)
+        rows = []
+        for i in range(n):
+            ad = random_ad(rng, user_id=rng.randint(1, max(1, total // 5)))
+            created = now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600))
+            status = "archived" if rng.random() < 0.2 else "active"
+            rows.append((*ad, encode_embedding(vecs[i]), status, created.isoformat(sep=" ", timespec="seconds")))
+        done += n
+        yield rows
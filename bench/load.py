@@ -0,0 +1,419 @@
+"""
+Нагрузочный прогон всего бота: python -m bench.load [--rate 50] [--duration 30] [--users 200] [--out file.json]
+
+Поднимает в одном процессе заглушку Bot API (sendMessage, editMessageText,
+answerCallbackQuery с настраиваемой задержкой и долей ответов 429) и
+настоящее приложение из main.py: вебхук, Dispatcher, роутер, SQLite и
+кодировщик. Виртуальные пользователи проходят сценарии «Нашёл», «Потерял»,
+«Мои объявления» с завершением объявления; апдейты идут в вебхук с общим
+темпом --rate. Задержка шага — от POST в вебхук до ответа бота в этот чат,
+который ждёт шаг (у каждого шага своя проверка: начало текста, кнопки или
+правка сообщения), то есть с очередями UpdateScheduler и OutboundScheduler.
+Запоздавшие ответы прошлых шагов и уведомления о совпадениях не засчитываются,
+а считаются в leftovers; answerCallbackQuery в ответы шагов не попадает.
+
+Всё локально: БД во временном каталоге, --corpus объявлений заранее. Без
+локально сохранённой модели можно взять --encoder-ms: синтетический
+кодировщик с заданным временем инференса вместо MiniLM. Лимиты отправки
+берутся из SEND_GLOBAL_RATE / SEND_CHAT_RATE, как в боте.
+
+Пользователь ждёт ответа на шаг перед следующим, поэтому updates_per_s ниже
+--rate означает, что узкое место — сам бот или лимиты отправки. Отчёт
+(--out) сравнивается с прошлым прогоном через bench.compare.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import zlib
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from aiohttp import ClientSession, ClientTimeout, web
+
+from bench.data import DROP_PLACES, random_description
+from constants import ITEM_TYPES, LOCATION_CHOICES, LOCATIONS
+
+BOT_TOKEN = "123456:LOADTEST"
+SCENARIOS = (("found", 0.3), ("lost", 0.5), ("my_ads", 0.2))
+
+
+# === ЗАГЛУШКА BOT API ===
+class Reply:
+    __slots__ = ("method", "chat_id", "message_id", "text", "markup", "at")
+
+    def __init__(self, method: str, chat_id: int, message_id: int, text: str, markup: Optional[dict]):
+        self.method = method
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.markup = markup
+        self.at = time.perf_counter()
+
+    def buttons(self, prefix: str) -> List[str]:
+        rows = (self.markup or {}).get("inline_keyboard", [])
+        return [b["callback_data"] for row in rows for b in row if b.get("callback_data", "").startswith(prefix)]
+
+
+class FakeBotAPI:
+    """Отвечает как Bot API и раскладывает ответы бота по очередям чатов."""
+
+    def __init__(self, latency_ms: float = 30, error_rate: float = 0.0, retry_after: int = 1, seed: int = 1):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.injected_429 = 0
+        self.inboxes: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self._message_ids: Dict[int, int] = defaultdict(int)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def _message(self, chat_id: int, message_id: int, text: str) -> dict:
+        return {
+            "message_id": message_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 123456, "is_bot": True, "first_name": "WhereIsMy"},
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.injected_429 += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            if method == "sendMessage":
+                self._message_ids[chat_id] += 1
+                message_id = self._message_ids[chat_id]
+            else:
+                message_id = int(params["message_id"])
+            markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+            self.inboxes[chat_id].put_nowait(Reply(method, chat_id, message_id, params.get("text", ""), markup))
+            return web.json_response({"ok": True, "result": self._message(chat_id, message_id, params.get("text", ""))})
+        # answerCallbackQuery — только подтверждение нажатия, ответом шага не считается
+        return web.json_response({"ok": True, "result": True})
+
+
+# === ВИРТУАЛЬНЫЕ ПОЛЬЗОВАТЕЛИ ===
+class Pacer:
+    """Общий темп апдейтов: не чаще rate в секунду на всех виртуальных пользователей."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_at = time.monotonic()
+
+    async def wait(self):
+        now = time.monotonic()
+        delay = self.next_at - now
+        self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+Expect = Callable[[Reply], bool]
+
+
+def starts(*prefixes: str) -> Expect:
+    return lambda reply: reply.method == "sendMessage" and reply.text.startswith(prefixes)
+
+
+def edited(reply: Reply) -> bool:
+    return reply.method == "editMessageText"
+
+
+class Stats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.leftovers: Dict[str, int] = defaultdict(int)  # чужие ответы, отброшенные шагом
+        self.sent = 0
+        self.completed = 0
+
+
+class Harness:
+    def __init__(self, api: FakeBotAPI, http: ClientSession, webhook_url: str, pacer: Pacer,
+                 stats: Stats, timeout: float):
+        self.api = api
+        self.http = http
+        self.webhook_url = webhook_url
+        self.pacer = pacer
+        self.stats = stats
+        self.timeout = timeout
+        self._update_id = 0
+
+    def next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+
+class VirtualUser:
+    def __init__(self, harness: Harness, user_id: int, rng: random.Random):
+        self.h = harness
+        self.user_id = user_id
+        self.rng = rng
+        self.inbox = harness.api.inboxes[user_id]
+        self._message_id = 0
+        self._callback_id = 0
+
+    @property
+    def _user(self) -> dict:
+        return {"id": self.user_id, "is_bot": False, "first_name": f"user{self.user_id}"}
+
+    async def _reply(self, label: str, expect: Expect, deadline: float) -> Reply:
+        """Первый ответ, подходящий шагу; остальное — хвосты прошлых шагов."""
+        while True:
+            reply = await asyncio.wait_for(self.inbox.get(), deadline - time.monotonic())
+            if expect(reply):
+                return reply
+            self.h.stats.leftovers[label] += 1
+
+    async def _step(self, label: str, update: dict, expect: Expect) -> Optional[Reply]:
+        await self.h.pacer.wait()
+        while not self.inbox.empty():  # хвосты предыдущих шагов
+            self.inbox.get_nowait()
+            self.h.stats.leftovers[label] += 1
+        update["update_id"] = self.h.next_update_id()
+        self.h.stats.sent += 1
+        started = time.perf_counter()
+        try:
+            async with self.h.http.post(self.h.webhook_url, json=update) as response:
+                await response.read()
+                if response.status != 200:
+                    self.h.stats.errors[f"{label}: HTTP {response.status}"] += 1
+                    return None
+            reply = await self._reply(label, expect, time.monotonic() + self.h.timeout)
+        except asyncio.TimeoutError:
+            self.h.stats.errors[f"{label}: нет ответа за {self.h.timeout:g} с"] += 1
+            return None
+        except Exception as e:
+            self.h.stats.errors[f"{label}: {type(e).__name__}"] += 1
+            return None
+        self.h.stats.latencies[label].append(reply.at - started)
+        self.h.stats.completed += 1
+        return reply
+
+    async def text(self, label: str, text: str, expect: Expect) -> Optional[Reply]:
+        self._message_id += 1
+        return await self._step(label, {"message": {
+            "message_id": self._message_id, "date": int(time.time()), "text": text,
+            "chat": {"id": self.user_id, "type": "private"}, "from": self._user,
+        }}, expect)
+
+    async def callback(self, label: str, data: str, message: Reply, expect: Expect) -> Optional[Reply]:
+        self._callback_id += 1
+        return await self._step(label, {"callback_query": {
+            "id": f"{self.user_id}:{self._callback_id}", "from": self._user,
+            "chat_instance": str(self.user_id), "data": data,
+            "message": {
+                "message_id": message.message_id, "date": int(time.time()), "text": message.text,
+                "chat": {"id": self.user_id, "type": "private"},
+                "from": {"id": 123456, "is_bot": True, "first_name": "WhereIsMy"},
+            },
+        }}, expect)
+
+    # --- сценарии ---
+    async def found(self):
+        item_type = self.rng.choice(ITEM_TYPES)
+        steps = [
+            ("found: меню", "🔍 Нашёл", starts("Что вы нашли?")),
+            ("found: тип", item_type, starts("Опишите предмет")),
+            ("found: описание", random_description(self.rng, item_type)[:100], starts("Где нашли?")),
+            ("found: корпус", self.rng.choice(list(LOCATIONS)), starts("Уточните место")),
+            ("found: место", "Пропустить", starts("Как передать находку?")),
+        ]
+        reply = None
+        for label, text, expect in steps:
+            reply = await self.text(label, text, expect)
+            if reply is None:
+                return
+        if await self.callback("found: способ передачи", "contact_type:drop", reply,
+                               starts("Где оставили находку?")) is None:
+            return
+        await self.text("found: публикация", self.rng.choice(DROP_PLACES), starts("✅ Объявление о находке опубликовано"))
+
+    async def lost(self):
+        item_type = self.rng.choice(ITEM_TYPES)
+        free_text = random_description(self.rng, item_type) if self.rng.random() < 0.5 else "Пропустить"
+        for label, text, expect in (
+            ("lost: меню", "❓ Потерял", starts("Что потеряли?")),
+            ("lost: тип", item_type, starts("Где потеряли?")),
+            ("lost: корпус", self.rng.choice(LOCATION_CHOICES), starts("Опишите вещь")),
+        ):
+            if await self.text(label, text, expect) is None:
+                return
+        reply = await self.text("lost: поиск", free_text, starts("🔎 Результаты", "🔍 Ничего не найдено"))
+        more = reply.buttons("more:") if reply else []
+        if more and self.rng.random() < 0.5:
+            await self.callback("lost: ещё", more[0], reply, starts("🔎 Результаты"))
+
+    async def my_ads(self):
+        reply = await self.text(
+            "my_ads: список", "📋 Мои объявления",
+            lambda r: starts("📭")(r) or (r.method == "sendMessage" and bool(r.buttons("archive:")))
+        )
+        archive = reply.buttons("archive:") if reply else []
+        if archive and self.rng.random() < 0.5:
+            await self.callback("my_ads: завершить", archive[0], reply, edited)
+
+    async def run(self, deadline: float):
+        await self.text("start", "/start", starts("🎓"))
+        names, weights = zip(*SCENARIOS)
+        while time.monotonic() < deadline:
+            await getattr(self, self.rng.choices(names, weights)[0])()
+
+
+# === ЗАПУСК ===
+def use_synthetic_encoder(latency_ms: float):
+    """Кодировщик без модели: детерминированные векторы и заданное время инференса."""
+    import encoders
+
+    class SyntheticBackend(encoders.EncoderBackend):
+        name = "synthetic"
+
+        def _load(self):
+            pass
+
+        def _encode(self, texts: List[str]) -> np.ndarray:
+            time.sleep(latency_ms / 1000)
+            vectors = np.stack([
+                np.random.default_rng(zlib.crc32(t.encode())).normal(size=384).astype(np.float32)
+                for t in texts
+            ])
+            return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    encoders.BACKENDS["synthetic"] = SyntheticBackend
+    encoders.ENCODER_BACKEND = "synthetic"
+
+
+async def start_site(app: web.Application) -> Tuple[web.AppRunner, int]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+async def run(args) -> Dict:
+    from bench.run import peak_rss_mb, seed, summarize
+    import database
+
+    if args.corpus:
+        await database.init_db()
+        await seed(args.corpus)
+        await database.close_db()
+
+    api = FakeBotAPI(args.api_latency_ms, args.error_rate, args.retry_after)
+    api_runner, api_port = await start_site(api.app())
+
+    import main as bot_main
+    from aiogram.client.telegram import TelegramAPIServer
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)  # строка на каждый апдейт
+    bot_main.bot.session.api = TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}")
+    bot_runner, bot_port = await start_site(bot_main.app)  # on_startup бота: БД, индекс, воркеры
+
+    stats = Stats()
+    async with ClientSession(timeout=ClientTimeout(total=args.timeout)) as http:
+        harness = Harness(
+            api, http, f"http://127.0.0.1:{bot_port}{bot_main.WEBHOOK_PATH}",
+            Pacer(args.rate), stats, args.timeout
+        )
+        users = [VirtualUser(harness, 1_000_000 + i, random.Random(i)) for i in range(args.users)]
+        started = time.monotonic()
+        deadline = started + args.duration
+        await asyncio.gather(*(user.run(deadline) for user in users))
+        elapsed = time.monotonic() - started
+
+    await bot_runner.cleanup()
+    await api_runner.cleanup()
+
+    all_latencies = [lat for lats in stats.latencies.values() for lat in lats]
+    errors = sum(stats.errors.values())
+    return {
+        "updates_sent": stats.sent,
+        "updates_per_s": round(stats.sent / elapsed, 2),
+        "error_rate": round(errors / stats.sent, 4) if stats.sent else None,
+        "errors": dict(stats.errors),
+        "leftovers": dict(stats.leftovers),
+        "end_to_end": summarize(all_latencies, elapsed) if all_latencies else None,
+        "steps": {label: summarize(lats, elapsed) for label, lats in sorted(stats.latencies.items())},
+        "bot_api": {"calls": dict(api.calls), "injected_429": api.injected_429},
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def print_report(results: Dict):
+    print(f"\nАпдейтов: {results['updates_sent']} · {results['updates_per_s']}/с · ошибок {results['error_rate']:.2%}")
+    print(f"{'шаг':32} {'n':>6} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9}")
+    rows = dict(results["steps"])
+    if results["end_to_end"]:
+        rows["ВСЕГО"] = results["end_to_end"]
+    for label, m in rows.items():
+        print(f"{label:32} {m['n']:>6} {m['p50_ms']:>9.1f} {m['p95_ms']:>9.1f} {m['p99_ms']:>9.1f}")
+    for label, count in results["errors"].items():
+        print(f"  ⚠️ {label}: {count}")
+    if results["leftovers"]:
+        print(f"Отброшено чужих ответов: {sum(results['leftovers'].values())} {results['leftovers']}")
+    print(f"Bot API: {results['bot_api']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота через вебхук")
+    parser.add_argument("--rate", type=float, default=50, help="апдейтов в секунду на всех")
+    parser.add_argument("--duration", type=float, default=30, help="секунд нагрузки")
+    parser.add_argument("--users", type=int, default=200, help="виртуальных пользователей")
+    parser.add_argument("--corpus", type=int, default=10000, help="объявлений в БД до старта")
+    parser.add_argument("--api-latency-ms", type=float, default=30, help="задержка ответа Bot API")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429")
+    parser.add_argument("--timeout", type=float, default=30, help="сколько ждать ответа бота на шаг")
+    parser.add_argument("--encoder-ms", type=float, help="синтетический кодировщик с таким временем инференса")
+    parser.add_argument("--out", help="записать результаты в JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="whereismy-load-") as workdir:
+        # До импорта database/main: они читают окружение при импорте
+        os.environ.update(BOT_TOKEN=BOT_TOKEN, DB_PATH=os.path.join(workdir, "load.db"))
+        os.environ.pop("RENDER", None)
+        if args.encoder_ms is not None:
+            use_synthetic_encoder(args.encoder_ms)
+        results = asyncio.run(run(args))
+
+    print_report(results)
+    if args.out:
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": vars(args),
+            },
+            "results": {"load": results},
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ Результаты записаны в {args.out}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
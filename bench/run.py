@@ -0,0 +1,196 @@
+"""
+Прогон бенчмарков: python -m bench.run [--sizes 1000,100000] [--out file.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+import database
+from bench.data import generate_rows, random_ad, random_embeddings
+from constants import ITEM_TYPES, LOCATIONS
+from formatting import format_ad_message
+
+DEFAULT_SIZES = "1000,100000,1000000"
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def summarize(latencies: List[float], elapsed: float, items: int = None) -> Dict:
+    """Перцентили в миллисекундах, пропускная способность в операциях (или элементах) в секунду."""
+    lat = np.array(latencies) * 1000
+    items = items if items is not None else len(latencies)
+    return {
+        "n": len(latencies),
+        "p50_ms": round(float(np.percentile(lat, 50)), 4),
+        "p95_ms": round(float(np.percentile(lat, 95)), 4),
+        "p99_ms": round(float(np.percentile(lat, 99)), 4),
+        "mean_ms": round(float(lat.mean()), 4),
+        "throughput_per_s": round(items / elapsed, 2) if elapsed > 0 else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def measure(fn: Callable, calls: int) -> Dict:
+    latencies = []
+    start = time.perf_counter()
+    for i in range(calls):
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def measure_async(fn: Callable, calls: int) -> Dict:
+    latencies = []
+    start = time.perf_counter()
+    for i in range(calls):
+        t = time.perf_counter()
+        await fn(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def seed(size: int):
+    for rows in generate_rows(size):
+        async with database.db.write() as conn:
+            await conn.executemany("""
+                INSERT INTO ads (
+                    user_id, ad_type, item_type, description, photo_file_id,
+                    location_key, place_detail, contact_type, contact_info,
+                    embedding, status, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+
+def bench_encode(calls: int, batch_size: int) -> Dict:
+    from search import encode_batch, encode_text
+    rng = random.Random(1)
+    texts = [" ".join(map(str, random_ad(rng, 1)[2:4])) for _ in range(max(calls, batch_size))]
+    try:
+        encode_text(texts[0])  # загрузка модели не входит в замер
+    except Exception as e:
+        return {"skipped": f"{type(e).__name__}: {e}"}
+    single = measure(lambda i: encode_text(texts[i]), calls)
+    batches = max(1, calls // batch_size)
+    batched = measure(lambda i: encode_batch(texts[:batch_size]), batches)
+    batched["throughput_per_s"] = round(batched["throughput_per_s"] * batch_size, 2)
+    batched["batch_size"] = batch_size
+    return {"single": single, "batched": batched}
+
+
+async def run_size(size: int, calls: int, workdir: str) -> Dict:
+    path = os.path.join(workdir, f"bench_{size}.db")
+    database.db = database.Database(path)
+    await database.init_db()
+    results = {}
+
+    t = time.perf_counter()
+    await seed(size)
+    results["seed_seconds"] = round(time.perf_counter() - t, 2)
+
+    rng = random.Random(7)
+    np_rng = np.random.default_rng(7)
+    locations = list(LOCATIONS)
+
+    ads = [random_ad(rng, 1) for _ in range(calls)]
+    vecs = random_embeddings(np_rng, calls)
+    results["create_ad"] = await measure_async(
+        lambda i: database.create_ad(*ads[i], embedding=vecs[i]), calls
+    )
+
+    queries = [
+        (rng.choice(ITEM_TYPES), rng.choice(locations) if rng.random() < 0.7 else None)
+        for _ in range(calls)
+    ]
+    # Для страниц выдачи ниже — первые 5 объявлений из первых 20 запросов
+    page_ids = []
+    candidate_counts = []
+
+    async def query(i):
+        rows = await database.get_active_ads_by_type_and_location(*queries[i])
+        candidate_counts.append(len(rows))
+        if i < 20:
+            page_ids.extend(ad.id for ad in rows[:5])
+
+    results["get_active_ads_by_type_and_location"] = await measure_async(query, calls)
+    results["avg_candidates"] = round(sum(candidate_counts) / len(candidate_counts), 1)
+
+    from vector_index import ad_index
+    ad_index.clear()
+    t = time.perf_counter()
+    await database.load_ad_index()
+    results["ad_index_load_seconds"] = round(time.perf_counter() - t, 2)
+    query_vecs = random_embeddings(np_rng, calls)
+    results["ad_index_search"] = measure(
+        lambda i: ad_index.search(query_vecs[i], *queries[i], k=50), calls
+    )
+    # Путь поиска без текста в боте: свой и соседние корпуса с надбавкой за близость
+    from search import search_nearby
+    results["search_nearby"] = measure(
+        lambda i: search_nearby(query_vecs[i], *queries[i], k=50), calls
+    )
+
+    rows = await database.get_ads_by_ids(page_ids)
+    if rows:
+        results["format_ad_message"] = measure(lambda i: format_ad_message(rows[i % len(rows)]), calls * 10)
+        # Страница выдачи из прогретого кэша: без БД и форматирования
+        from result_cache import ResultCache
+        cache = ResultCache()
+        pages = [[ad.id for ad in rows[j:j + 5]] for j in range(0, len(rows), 5)]
+        for page in pages:
+            await cache.render(page, database.get_ads_by_ids)
+        results["result_cache_render"] = await measure_async(
+            lambda i: cache.render(pages[i % len(pages)], database.get_ads_by_ids), calls
+        )
+
+    await database.close_db()
+    return results
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей бота")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="размеры корпуса через запятую")
+    parser.add_argument("--calls", type=int, default=500, help="вызовов на каждый замер")
+    parser.add_argument("--batch-size", type=int, default=32, help="размер батча для encode")
+    parser.add_argument("--skip-encode", action="store_true", help="не замерять модель")
+    parser.add_argument("--out", default="bench_output.json")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "calls": args.calls,
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="whereismy-bench-") as workdir:
+        for size in (int(s) for s in args.sizes.split(",")):
+            print(f"⏱ {size} объявлений...", flush=True)
+            report["results"][str(size)] = await run_size(size, args.calls, workdir)
+    if not args.skip_encode:
+        report["results"]["encode_text"] = bench_encode(min(args.calls, 200), args.batch_size)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Результаты записаны в {args.out}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,322 @@
+"""
+Массовые операции с объявлениями:
+
+    python bulk.py import ads.jsonl|ads.csv [--user-id 0] [--batch 256] [--chunk 2000]
+    python bulk.py export out.jsonl|out.csv [--status active|archived|all]
+    python bulk.py reembed [--batch 256] [--restart]
+
+Импорт читает файл потоком, кодирует тексты большими батчами модели и
+пишет executemany-пачками, каждая — своя транзакция; кодирование следующего
+батча идёт параллельно с записью предыдущего. Поля — как в экспорте
+(id игнорируется), обязательны item_type и location_key.
+
+reembed пересчитывает колонку embedding всех объявлений в ads с постоянным
+расходом памяти. Прогресс (последний id) хранится в reembed_progress в той же
+транзакции, что и пачка, поэтому прерванный запуск продолжается с места
+остановки; для новой модели проход начинается заново.
+
+Импортированные объявления запущенный бот подхватит сам (разделы
+перечитываются по ad_generations), пересчитанные reembed векторы — после
+перезапуска (индекс загружается при старте).
+"""
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from constants import ITEM_TYPES, LOCATIONS
+from database import bump_generations, close_db, db, embedding_to_blob, init_db
+from encoders import get_backend
+from search import encode_batch
+
+EXPORT_FIELDS = (
+    "id", "user_id", "ad_type", "item_type", "description", "photo_file_id",
+    "location_key", "place_detail", "contact_type", "contact_info", "status", "created_at"
+)
+IMPORT_FIELDS = EXPORT_FIELDS[1:]
+
+
+def _format(path: str, explicit: Optional[str]) -> str:
+    fmt = explicit or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    if fmt not in ("csv", "jsonl"):
+        raise SystemExit(f"❌ Неизвестный формат: {fmt}")
+    return fmt
+
+
+def read_rows(path: str, fmt: str) -> Iterator[Optional[Dict]]:
+    """Строки файла; вместо нечитаемой строки JSONL — None (её посчитают пропущенной)."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield row if isinstance(row, dict) else None
+
+
+def embedding_text(item_type: str, description: Optional[str]) -> str:
+    # Как в found_finish
+    return f"{item_type} {description or ''}"
+
+
+def _progress(label: str, done: int, total: int, started: float):
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed > 0 else 0
+    eta = (total - done) / rate if rate and total else 0
+    logging.info(f"{label}: {done}/{total or '?'} · {rate:.0f} строк/с · осталось ~{eta:.0f} с")
+
+
+# === ИМПОРТ ===
+# В базе даты в формате CURRENT_TIMESTAMP (UTC); его ждёт format_ad_message
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+IMPORT_DATE_FORMATS = ("%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M", "%d.%m.%Y")
+
+
+def parse_created_at(value) -> Optional[str]:
+    """Дата из файла в формате DATE_FORMAT; None — если разобрать не удалось."""
+    value = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        for fmt in IMPORT_DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime(DATE_FORMAT)
+
+
+def _prepare(row: Optional[Dict], default_user_id: int) -> Optional[Tuple]:
+    if row is None:
+        return None
+    item_type = str(row.get("item_type") or "").strip()
+    location_key = str(row.get("location_key") or "").strip()
+    if item_type not in ITEM_TYPES or location_key not in LOCATIONS:
+        return None
+    values = {field: row.get(field) or None for field in IMPORT_FIELDS}
+    try:
+        user_id = int(values["user_id"] or default_user_id)
+    except (TypeError, ValueError):
+        return None
+    if values["created_at"] is not None:
+        values["created_at"] = parse_created_at(values["created_at"])
+        if values["created_at"] is None:
+            return None
+    values.update(
+        user_id=user_id,
+        ad_type=values["ad_type"] or "found",
+        item_type=item_type,
+        location_key=location_key,
+        status=values["status"] or "active",
+    )
+    # Те же ограничения, что CHECK в таблице ads: одна плохая строка не должна валить пачку
+    if (values["ad_type"] not in ("found", "lost") or values["status"] not in ("active", "archived")
+            or values["contact_type"] not in (None, "drop", "contact")):
+        return None
+    return tuple(values[field] for field in IMPORT_FIELDS)
+
+
+async def _write_chunk(rows: List[Tuple], vectors) -> None:
+    params = [
+        row + (embedding_to_blob(vec),)
+        for row, vec in zip(rows, vectors)
+    ]
+    columns = ", ".join(IMPORT_FIELDS)
+    async with db.write() as conn:
+        await conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+            [(user_id,) for user_id in {row[0] for row in rows}]
+        )
+        await conn.executemany(f"""
+            INSERT INTO ads ({columns}, embedding)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)
+        """, params)
+        # Запущенный бот перечитает эти разделы при сверке с ad_generations
+        await bump_generations(conn, [(row[2], row[5]) for row in rows])
+
+
+async def import_ads(path: str, fmt: str, user_id: int = 0, batch: int = 256, chunk: int = 2000) -> Tuple[int, int]:
+    """Возвращает (импортировано, пропущено)."""
+    loop = asyncio.get_running_loop()
+    imported = skipped = 0
+    started = time.perf_counter()
+    pending_write: Optional[asyncio.Task] = None
+    rows: List[Tuple] = []
+
+    async def flush(rows: List[Tuple]):
+        nonlocal pending_write
+        texts = [embedding_text(row[2], row[3]) for row in rows]
+        vectors = []
+        for i in range(0, len(texts), batch):
+            vectors.extend(await loop.run_in_executor(None, encode_batch, texts[i:i + batch]))
+        if pending_write is not None:
+            await pending_write
+        pending_write = asyncio.create_task(_write_chunk(rows, vectors))
+
+    for raw in read_rows(path, fmt):
+        row = _prepare(raw, user_id)
+        if row is None:
+            skipped += 1
+            continue
+        rows.append(row)
+        if len(rows) >= chunk:
+            await flush(rows)
+            imported += len(rows)
+            rows = []
+            _progress("Импорт", imported, 0, started)
+    if rows:
+        await flush(rows)
+        imported += len(rows)
+    if pending_write is not None:
+        await pending_write
+    return imported, skipped
+
+
+# === ЭКСПОРТ ===
+async def export_ads(path: str, fmt: str, status: str = "all", batch: int = 1000) -> int:
+    # Таблицы по очереди, каждая по первичному ключу: UNION ALL из ads_history
+    # пришлось бы сортировать на каждой пачке
+    archive_columns = ", ".join(EXPORT_FIELDS).replace("status", "'archived'")
+    sources = []
+    if status != "archived":
+        sources.append(f"SELECT {', '.join(EXPORT_FIELDS)} FROM ads WHERE id > ?"
+                       + (" AND status = 'active'" if status == "active" else ""))
+    if status == "archived":
+        sources.append(f"SELECT {', '.join(EXPORT_FIELDS)} FROM ads WHERE id > ? AND status = 'archived'")
+    if status != "active":
+        sources.append(f"SELECT {archive_columns} FROM ads_archive WHERE id > ?")
+
+    exported = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(EXPORT_FIELDS)
+        for query in sources:
+            last_id = 0
+            while True:
+                async with db.read() as conn:
+                    cursor = await conn.execute(f"{query} ORDER BY id LIMIT ?", (last_id, batch))
+                    rows = await cursor.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                for row in rows:
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        f.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + "\n")
+                exported += len(rows)
+    return exported
+
+
+# === ПЕРЕКОДИРОВАНИЕ ===
+async def reembed(batch: int = 256, restart: bool = False) -> int:
+    """Пересчитывает эмбеддинги всех объявлений в ads. Возвращает число строк за этот запуск."""
+    model_id = get_backend().model_id
+    async with db.write() as conn:
+        # Таблица reembed_progress создаётся миграцией (database.MIGRATIONS)
+        if restart:
+            await conn.execute("DELETE FROM reembed_progress WHERE model_id = ?", (model_id,))
+        cursor = await conn.execute("SELECT last_id FROM reembed_progress WHERE model_id = ?", (model_id,))
+        row = await cursor.fetchone()
+    last_id = row[0] if row else 0
+    if last_id:
+        logging.info(f"Продолжаем с id > {last_id} (модель {model_id})")
+
+    async with db.read() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM ads WHERE id > ?", (last_id,))
+        total = (await cursor.fetchone())[0]
+
+    loop = asyncio.get_running_loop()
+    done = 0
+    started = time.perf_counter()
+    while True:
+        async with db.read() as conn:
+            cursor = await conn.execute("""
+                SELECT id, item_type, description FROM ads
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (last_id, batch))
+            rows = await cursor.fetchall()
+        if not rows:
+            break
+        vectors = await loop.run_in_executor(
+            None, encode_batch, [embedding_text(item_type, desc) for _, item_type, desc in rows]
+        )
+        last_id = rows[-1][0]
+        async with db.write() as conn:
+            await conn.executemany(
+                "UPDATE ads SET embedding = ? WHERE id = ?",
+                [(embedding_to_blob(vec), ad_id) for (ad_id, _, _), vec in zip(rows, vectors)]
+            )
+            await conn.execute("""
+                INSERT INTO reembed_progress (model_id, last_id) VALUES (?, ?)
+                ON CONFLICT(model_id) DO UPDATE SET
+                    last_id = excluded.last_id, updated_at = CURRENT_TIMESTAMP
+            """, (model_id, last_id))
+        done += len(rows)
+        _progress("Перекодирование", done, total, started)
+    return done
+
+
+def main(argv: List[str]):
+    parser = argparse.ArgumentParser(description="Импорт, экспорт и перекодирование объявлений")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="загрузить объявления из JSONL/CSV")
+    p_import.add_argument("path")
+    p_import.add_argument("--format", choices=("jsonl", "csv"))
+    p_import.add_argument("--user-id", type=int, default=0, help="автор, если в строке не указан")
+    p_import.add_argument("--batch", type=int, default=256, help="текстов за один вызов модели")
+    p_import.add_argument("--chunk", type=int, default=2000, help="строк в одной транзакции")
+
+    p_export = sub.add_parser("export", help="выгрузить объявления в JSONL/CSV")
+    p_export.add_argument("path")
+    p_export.add_argument("--format", choices=("jsonl", "csv"))
+    p_export.add_argument("--status", choices=("active", "archived", "all"), default="all")
+
+    p_reembed = sub.add_parser("reembed", help="пересчитать эмбеддинги текущей моделью")
+    p_reembed.add_argument("--batch", type=int, default=256)
+    p_reembed.add_argument("--restart", action="store_true", help="начать заново, а не продолжать")
+
+    args = parser.parse_args(argv)
+
+    async def _main():
+        try:
+            await init_db()
+            if args.command == "import":
+                imported, skipped = await import_ads(
+                    args.path, _format(args.path, args.format), args.user_id, args.batch, args.chunk
+                )
+                print(f"✅ Импортировано: {imported}, пропущено некорректных строк: {skipped}")
+            elif args.command == "export":
+                count = await export_ads(args.path, _format(args.path, args.format), args.status)
+                print(f"✅ Выгружено: {count}")
+            else:
+                count = await reembed(args.batch, args.restart)
+                print(f"✅ Перекодировано: {count}")
+        finally:
+            await close_db()
+
+    asyncio.run(_main())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
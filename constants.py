@@ -0,0 +1,28 @@
+# Справочники бота: типы вещей и корпуса
+ITEM_TYPES = [
+    "Карту-пропуск", "Гардеробный номерок", "Ключи",
+    "Повербанк", "Зонтик", "Кошелёк", "Другое…"
+]
+LOCATIONS = {
+    "ФЭБ (ВДНХ)": "м. ВДНХ, ул. Кибальчича, д. 1, стр. 2",
+    "Финансовый (Китай-город)": "м. Китай-город, Малый Златоустинский пер., д. 7, стр. 1",
+    "Финансовый (Филёвский парк)": "м. Филёвский парк, ул. Олеко Дундича, д. 23",
+    "ФНАБА (Динамо)": "м. Динамо, ул. Верхняя Масловка, д. 15",
+    "ФМЭО (Аэропорт)": "м. Аэропорт, Ленинградский просп., д. 49",
+    "ВШУ (Динамо)": "м. Динамо, ул. Верхняя Масловка, д. 15",
+    "Юрфак (Семёновская)": "м. Семёновская, ул. Щербаковская, д. 38",
+    "ФСНиМК (Аэропорт)": "м. Аэропорт, Ленинградский просп., д. 49",
+    "ИТиАБД (Рязанский просп.)": "м. Рязанский проспект, 4-й Вешняковский пр., д. 4",
+    "ИОО (Филёвский парк)": "м. Филёвский парк, ул. Олеко Дундича, д. 23"
+}
+LOCATION_CHOICES = list(LOCATIONS.keys()) + ["Не помню"]
+# Координаты зданий (по адресам из LOCATIONS) — для близости корпусов, см. locations.py
+BUILDING_COORDS = {
+    "м. ВДНХ, ул. Кибальчича, д. 1, стр. 2": (55.8197, 37.6438),
+    "м. Китай-город, Малый Златоустинский пер., д. 7, стр. 1": (55.7571, 37.6352),
+    "м. Филёвский парк, ул. Олеко Дундича, д. 23": (55.7397, 37.4785),
+    "м. Динамо, ул. Верхняя Масловка, д. 15": (55.7945, 37.5715),
+    "м. Аэропорт, Ленинградский просп., д. 49": (55.7880, 37.5461),
+    "м. Семёновская, ул. Щербаковская, д. 38": (55.7817, 37.7220),
+    "м. Рязанский проспект, 4-й Вешняковский пр., д. 4": (55.7175, 37.7880),
+}
@@ -1,20 +1,145 @@
 import aiosqlite
+import asyncio
 import os
-from typing import List, Optional, Tuple
+import logging
+import re
+import sys
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 import json
 import numpy as np
 
-DB_PATH = "ads.db"
+from embedding_codec import (
+    EMBEDDING_DTYPE, IncompatibleEmbedding, decode_embedding, encode_embedding,
+    needs_rewrite
+)
+from locations import nearby
+from metrics import db_seconds, timed
+from models import DISPLAY_COLUMNS, OWNER_COLUMNS, Ad
+import queries
+from result_cache import result_cache
+from vector_index import ad_index
+
+DB_PATH = os.getenv("DB_PATH", "ads.db")
+
+# === ПУЛ СОЕДИНЕНИЙ ===
+DB_READERS = int(os.getenv("DB_READERS", 2))
+DB_CACHED_STATEMENTS = 256  # кэш подготовленных выражений на соединение
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",      # ~16 МБ страничного кэша
+    "PRAGMA mmap_size = 134217728",    # 128 МБ
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",      # админка пишет в тот же файл
+)
+
+
+class Database:
+    """
+    Долгоживущие соединения с SQLite: пул читателей + один писатель.
+
+    В режиме WAL читатели не блокируют писателя и друг друга, а все записи
+    идут через единственное соединение под asyncio.Lock. Соединения живут
+    всё время работы бота, поэтому sqlite3 переиспользует подготовленные
+    выражения из своего кэша.
+    """
+
+    def __init__(self, path: str, readers: int = DB_READERS):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: List[aiosqlite.Connection] = []
+        self._pool: Optional[asyncio.Queue] = None
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, readonly: bool) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=DB_CACHED_STATEMENTS)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if readonly:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self):
+        async with self._open_lock:
+            if self.is_open:
+                return
+            # Писатель открывается первым: он создаёт файл и включает WAL
+            writer = await self._connect(readonly=False)
+            pool = asyncio.Queue()
+            for _ in range(self.readers_count):
+                conn = await self._connect(readonly=True)
+                self._readers.append(conn)
+                pool.put_nowait(conn)
+            self._pool = pool
+            self._writer = writer
+
+    async def close(self):
+        async with self._open_lock:
+            if not self.is_open:
+                return
+            async with self._write_lock:
+                await self._writer.close()
+                self._writer = None
+            for conn in self._readers:
+                await conn.close()
+            self._readers.clear()
+            self._pool = None
+
+    @asynccontextmanager
+    async def read(self):
+        """Соединение только для чтения из пула."""
+        if not self.is_open:
+            await self.open()
+        pool = self._pool
+        conn = await pool.get()
+        try:
+            yield conn
+        finally:
+            pool.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self):
+        """Сериализованная транзакция на соединении писателя."""
+        if not self.is_open:
+            await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+db = Database(DB_PATH)
+
+
+async def open_db():
+    await db.open()
+
+
+async def close_db():
+    await db.close()
+
 
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
+    async with db.write() as conn:
+        await conn.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 user_id INTEGER PRIMARY KEY,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
-        await db.execute("""
+        await conn.execute("""
             CREATE TABLE IF NOT EXISTS ads (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
@@ -33,15 +158,208 @@ async def init_db():
             )
         """)
         # Индексы для быстрого поиска
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_status ON ads(status)")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_ads_active_type_loc ON ads(ad_type, item_type, location_key) WHERE status = 'active'")
-        await db.commit()
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ads_status ON ads(status)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ads_active_type_loc ON ads(ad_type, item_type, location_key) WHERE status = 'active'")
+        # Админка листает объявления по дате (keyset-пагинация)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ads_created ON ads(created_at, id)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ads_status_created ON ads(status, created_at, id)")
+        # Полнотекстовый индекс описаний (external content: тексты лежат в ads).
+        # unicode61 не сводит «ё» к «е», поэтому триггеры индексируют текст уже с заменой
+        # и удаляют с той же заменой — иначе FTS5 не найдёт удаляемые токены
+        cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'ads_fts'")
+        fts_exists = await cursor.fetchone() is not None
+        await conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS ads_fts USING fts5(
+                description, place_detail,
+                content = 'ads', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+        await conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS ads_fts_insert AFTER INSERT ON ads BEGIN
+                INSERT INTO ads_fts (rowid, description, place_detail)
+                VALUES (
+                    new.id,
+                    replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е'),
+                    replace(replace(new.place_detail, 'ё', 'е'), 'Ё', 'Е')
+                );
+            END
+        """)
+        await conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS ads_fts_delete AFTER DELETE ON ads BEGIN
+                INSERT INTO ads_fts (ads_fts, rowid, description, place_detail)
+                VALUES (
+                    'delete', old.id,
+                    replace(replace(old.description, 'ё', 'е'), 'Ё', 'Е'),
+                    replace(replace(old.place_detail, 'ё', 'е'), 'Ё', 'Е')
+                );
+            END
+        """)
+        await conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS ads_fts_update AFTER UPDATE OF description, place_detail ON ads BEGIN
+                INSERT INTO ads_fts (ads_fts, rowid, description, place_detail)
+                VALUES (
+                    'delete', old.id,
+                    replace(replace(old.description, 'ё', 'е'), 'Ё', 'Е'),
+                    replace(replace(old.place_detail, 'ё', 'е'), 'Ё', 'Е')
+                );
+                INSERT INTO ads_fts (rowid, description, place_detail)
+                VALUES (
+                    new.id,
+                    replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е'),
+                    replace(replace(new.place_detail, 'ё', 'е'), 'Ё', 'Е')
+                );
+            END
+        """)
+        if not fts_exists:
+            await conn.execute("""
+                INSERT INTO ads_fts (rowid, description, place_detail)
+                SELECT id, replace(replace(description, 'ё', 'е'), 'Ё', 'Е'),
+                       replace(replace(place_detail, 'ё', 'е'), 'Ё', 'Е')
+                FROM ads
+            """)
+        # Холодное хранилище: архивные объявления без эмбеддингов (см. maintenance.py)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS ads_archive (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                ad_type TEXT NOT NULL,
+                item_type TEXT NOT NULL,
+                description TEXT,
+                photo_file_id TEXT,
+                location_key TEXT NOT NULL,
+                place_detail TEXT,
+                contact_type TEXT,
+                contact_info TEXT,
+                created_at TIMESTAMP,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ads_archive_user ON ads_archive(user_id, created_at)")
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_ads_archive_created ON ads_archive(created_at, id)")
+        # Вся история (горячая + холодная таблица) — для админки и «Моих объявлений»
+        await conn.execute("""
+            CREATE VIEW IF NOT EXISTS ads_history AS
+            SELECT id, user_id, ad_type, item_type, description, photo_file_id,
+                   location_key, place_detail, contact_type, contact_info,
+                   status, created_at
+            FROM ads
+            UNION ALL
+            SELECT id, user_id, ad_type, item_type, description, photo_file_id,
+                   location_key, place_detail, contact_type, contact_info,
+                   'archived', created_at
+            FROM ads_archive
+        """)
+        # Сохранённые поиски для обратного сопоставления (location_key = '' — «не помню»)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS lost_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                item_type TEXT NOT NULL,
+                location_key TEXT NOT NULL DEFAULT '',
+                embedding BLOB NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                expires_at TIMESTAMP NOT NULL,
+                UNIQUE(user_id, item_type, location_key)
+            )
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_lost_requests_expires ON lost_requests(expires_at)")
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS match_notifications (
+                request_id INTEGER NOT NULL,
+                ad_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY(request_id, ad_id)
+            ) WITHOUT ROWID
+        """)
+        # Поколения разделов для кэша выдач: их увеличивает админка (другой процесс)
+        await conn.execute(queries.CREATE_AD_GENERATIONS)
+    await migrate()
 
+# === МИГРАЦИИ СХЕМЫ ===
+# (версия, описание, выражения). Таблицы выше создаются через IF NOT EXISTS и
+# составляют исходную схему; всё, что меняется после, добавляется сюда новой
+# версией. Каждая миграция — отдельная транзакция вместе с записью в schema_version.
+MIGRATIONS: List[Tuple[int, str, Tuple[str, ...]]] = [
+    (1, "индекс для «Мои объявления»", (
+        # get_user_ads: WHERE user_id = ? AND status = ? ORDER BY created_at DESC
+        "CREATE INDEX IF NOT EXISTS idx_ads_user_status_created ON ads(user_id, status, created_at)",
+    )),
+    (2, "прогресс перекодирования (bulk.py reembed)", (
+        """CREATE TABLE IF NOT EXISTS reembed_progress (
+            model_id TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+    )),
+    (3, "индекс архива для фильтров админки", (
+        # Счётчик и страницы админки по типу/корпусу: архив растёт без ограничений,
+        # а в индексе есть всё, что нужно COUNT(*) с этими фильтрами и датами
+        "CREATE INDEX IF NOT EXISTS idx_ads_archive_item_loc_created ON ads_archive(item_type, location_key, created_at)",
+    )),
+    (4, "индексы по корпусу и типу для страниц админки", (
+        # Фильтр по корпусу или типу + ORDER BY created_at DESC, id DESC LIMIT:
+        # без них страница обходит весь idx_ads_created / idx_ads_archive_created
+        "CREATE INDEX IF NOT EXISTS idx_ads_loc_created ON ads(location_key, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_ads_item_created ON ads(item_type, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_ads_archive_loc_created ON ads_archive(location_key, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS idx_ads_archive_item_created ON ads_archive(item_type, created_at, id)",
+    )),
+]
+
+async def schema_version() -> int:
+    async with db.read() as conn:
+        cursor = await conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return (await cursor.fetchone())[0]
+
+async def migrate() -> int:
+    """Применяет недостающие миграции по порядку. Возвращает итоговую версию."""
+    async with db.write() as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+    current = await schema_version()
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        async with db.write() as conn:
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description)
+            )
+        logging.info(f"🗂 Миграция {version}: {description}")
+        current = version
+    return current
+
+@timed(db_seconds)
 async def ensure_user(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
-        await db.commit()
+    async with db.write() as conn:
+        await conn.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
 
+# Счётчики разделов для кэша выдач (result_cache.py): меняются в той же
+# транзакции, что и объявления, — так запись видят остальные процессы
+BUMP_GENERATION = """
+    INSERT INTO ad_generations (item_type, location_key, generation) VALUES (?, ?, 1)
+    ON CONFLICT (item_type, location_key) DO UPDATE SET generation = generation + 1
+    RETURNING generation
+"""
+
+async def bump_generations(conn, partitions: Iterable[Tuple[str, str]]) -> List[Tuple[str, str, int]]:
+    """Увеличивает счётчики разделов; новые значения — для result_cache.bump после коммита."""
+    bumped = []
+    for item_type, location_key in dict.fromkeys(partitions):
+        cursor = await conn.execute(BUMP_GENERATION, (item_type, location_key))
+        bumped.append((item_type, location_key, (await cursor.fetchone())[0]))
+        await cursor.close()
+    return bumped
+
+@timed(db_seconds)
 async def create_ad(
     user_id: int,
     ad_type: str,
@@ -54,69 +372,482 @@ async def create_ad(
     contact_info: str,
     embedding: np.ndarray
 ) -> int:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
+    async with db.write() as conn:
+        cursor = await conn.execute("""
             INSERT INTO ads (
                 user_id, ad_type, item_type, description, photo_file_id,
                 location_key, place_detail, contact_type, contact_info, embedding
             ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             user_id, ad_type, item_type, description, photo_file_id,
-            location_key, place_detail, contact_type, contact_info, embedding.tobytes()
+            location_key, place_detail, contact_type, contact_info, embedding_to_blob(embedding)
         ))
-        await db.commit()
-        return cursor.lastrowid
+        ad_id = cursor.lastrowid
+        bumped = await bump_generations(conn, [(item_type, location_key)])
+    if ad_type == "found":  # в выдаче поиска только находки
+        ad_index.add(ad_id, item_type, location_key, embedding)
+    result_cache.bump(*bumped[0])
+    return ad_id
+
+DISPLAY_SQL = ", ".join(DISPLAY_COLUMNS)
+OWNER_SQL = ", ".join(OWNER_COLUMNS)
 
+def _active_filter(item_type: str, location_key: Optional[str], ad_type: str) -> Tuple[str, tuple]:
+    params: tuple = (ad_type, item_type)
+    where = "status = 'active' AND ad_type = ? AND item_type = ?"
+    if location_key:
+        keys = tuple(nearby(location_key))
+        where += f" AND location_key IN ({','.join('?' * len(keys))})"
+        params += keys
+    return where, params
+
+def _active_ads_query(item_type: str, location_key: Optional[str], ad_type: str) -> Tuple[str, tuple]:
+    where, params = _active_filter(item_type, location_key, ad_type)
+    return f"""
+        SELECT {DISPLAY_SQL}
+        FROM ads INDEXED BY idx_ads_active_type_loc
+        WHERE {where}
+    """, params
+
+@timed(db_seconds)
 async def get_active_ads_by_type_and_location(
     item_type: str,
-    location_key: Optional[str] = None
-) -> List[Tuple]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        if location_key:
-            query = """
-                SELECT id, user_id, ad_type, item_type, description, photo_file_id,
-                       location_key, place_detail, contact_type, contact_info, embedding
-                FROM ads
-                WHERE status = 'active' AND item_type = ? AND location_key = ?
-            """
-            params = (item_type, location_key)
-        else:
-            query = """
-                SELECT id, user_id, ad_type, item_type, description, photo_file_id,
-                       location_key, place_detail, contact_type, contact_info, embedding
-                FROM ads
-                WHERE status = 'active' AND item_type = ?
-            """
-            params = (item_type,)
-        cursor = await db.execute(query, params)
-        rows = await cursor.fetchall()
-        return rows
+    location_key: Optional[str] = None,
+    ad_type: str = "found"
+) -> List[Ad]:
+    """
+    Активные объявления типа item_type (проекция для показа, без эмбеддинга).
+    С корпусом — сразу по всем корпусам того же и соседних зданий
+    (locations.nearby) одним IN по idx_ads_active_type_loc; без корпуса — по
+    всем. INDEXED BY — чтобы до первого ANALYZE планировщик не выбрал индекс
+    по статусу.
+    """
+    async with db.read() as conn:
+        cursor = await conn.execute(*_active_ads_query(item_type, location_key, ad_type))
+        return [Ad(*row) for row in await cursor.fetchall()]
 
-async def get_user_ads(user_id: int, status: str = 'active') -> List[Tuple]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
-            SELECT id, ad_type, item_type, description, location_key, place_detail,
-                   contact_type, contact_info, status, created_at
-            FROM ads
-            WHERE user_id = ? AND status = ?
-            ORDER BY created_at DESC
-        """, (user_id, status))
-        return await cursor.fetchall()
+def _user_ads_query(user_id: int, status: str) -> Tuple[str, tuple]:
+    # Архивные могут лежать и в ads, и в ads_archive — берём из ads_history
+    table = "ads" if status == "active" else "ads_history"
+    return f"""
+        SELECT {OWNER_SQL}
+        FROM {table}
+        WHERE user_id = ? AND status = ?
+        ORDER BY created_at DESC
+    """, (user_id, status)
+
+@timed(db_seconds)
+async def get_user_ads(user_id: int, status: str = 'active') -> List[Ad]:
+    async with db.read() as conn:
+        cursor = await conn.execute(*_user_ads_query(user_id, status))
+        return [Ad(*row) for row in await cursor.fetchall()]
 
+@timed(db_seconds)
 async def archive_ad(ad_id: int, user_id: int) -> bool:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
+    async with db.write() as conn:
+        cursor = await conn.execute("""
             UPDATE ads SET status = 'archived'
             WHERE id = ? AND user_id = ?
+            RETURNING item_type, location_key
         """, (ad_id, user_id))
-        await db.commit()
-        return cursor.rowcount > 0
+        row = await cursor.fetchone()
+        await cursor.close()
+        if row is None:
+            return False
+        bumped = await bump_generations(conn, [row])
+    ad_index.remove(ad_id)
+    result_cache.bump(*bumped[0])
+    return True
+
+async def sync_result_cache():
+    """
+    Сверяет кэш выдач с поколениями из ad_generations (не чаще sync_interval).
+    Разделы, которые изменил другой процесс (админка, второй воркер, импорт),
+    перечитываются в ad_index — иначе поиск находил бы уже снятые объявления.
+    """
+    if not result_cache.sync_due:
+        return
+    async with db.read() as conn:
+        cursor = await conn.execute("SELECT item_type, location_key, generation FROM ad_generations")
+        changed = result_cache.apply_external(await cursor.fetchall())
+    if ad_index.loaded:
+        for item_type, location_key in changed:
+            await reload_ad_partition(item_type, location_key)
+
+PARTITION_EMBEDDINGS = """
+    SELECT id, embedding
+    FROM ads INDEXED BY idx_ads_active_type_loc
+    WHERE status = 'active' AND ad_type = 'found' AND item_type = ? AND location_key = ?
+      AND embedding IS NOT NULL
+"""
+
+async def reload_ad_partition(item_type: str, location_key: str):
+    generation = result_cache.generation(item_type, location_key)
+    async with db.read() as conn:
+        cursor = await conn.execute(PARTITION_EMBEDDINGS, (item_type, location_key))
+        rows = await cursor.fetchall()
+    if result_cache.generation(item_type, location_key) != generation:
+        # Пока читали, раздел поменяли в этом процессе — прочитанное могло устареть
+        result_cache.stale(item_type, location_key)
+        return
+    vectors = []
+    for ad_id, blob in rows:
+        try:
+            vectors.append((ad_id, blob_to_embedding(blob)))
+        except IncompatibleEmbedding:
+            continue
+    ad_index.replace_partition(item_type, location_key, vectors)
+
+def _ads_by_ids_query(ad_ids: List[int]) -> Tuple[str, tuple]:
+    return f"""
+        SELECT {DISPLAY_SQL}
+        FROM ads
+        WHERE id IN ({','.join('?' * len(ad_ids))}) AND status = 'active'
+    """, tuple(ad_ids)
 
-async def get_ad_by_id(ad_id: int) -> Optional[Tuple]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT * FROM ads WHERE id = ?", (ad_id,))
-        return await cursor.fetchone()
+@timed(db_seconds)
+async def get_ads_by_ids(ad_ids: List[int]) -> List[Ad]:
+    """Активные объявления по списку id в том же порядке (для выдачи поиска)."""
+    if not ad_ids:
+        return []
+    async with db.read() as conn:
+        cursor = await conn.execute(*_ads_by_ids_query(ad_ids))
+        rows = {row[0]: Ad(*row) for row in await cursor.fetchall()}
+    return [rows[ad_id] for ad_id in ad_ids if ad_id in rows]
+
+@timed(db_seconds)
+async def get_ad_by_id(ad_id: int) -> Optional[Ad]:
+    async with db.read() as conn:
+        cursor = await conn.execute(f"SELECT {OWNER_SQL} FROM ads WHERE id = ?", (ad_id,))
+        row = await cursor.fetchone()
+    return Ad(*row) if row else None
+
+# === ПОЛНОТЕКСТОВЫЙ ПОИСК ===
+FTS_MAX_TERMS = 8
+
+def fts_query(text: str) -> Optional[str]:
+    """
+    Свободный текст → выражение FTS5: слова через OR, длинные слова
+    усечены до основы и ищутся по префиксу («чёрного» → «черно*»), чтобы
+    ловить русские падежные формы без морфологического анализатора.
+    """
+    terms = []
+    for word in re.findall(r"\w+", text.lower().replace("ё", "е")):
+        if len(word) < 2:
+            continue
+        if len(word) >= 6:
+            stem = word[:-2]
+        elif len(word) >= 4:
+            stem = word[:-1]
+        else:
+            stem = word
+        terms.append(f'"{stem}"*')
+    return " OR ".join(dict.fromkeys(terms[:FTS_MAX_TERMS])) or None
+
+def _search_fts_query(query: str, item_type: str, location_key: Optional[str], limit: int) -> Tuple[str, tuple]:
+    params: tuple = (query, item_type)
+    location_filter = ""
+    if location_key:
+        keys = tuple(nearby(location_key))
+        location_filter = f"AND a.location_key IN ({','.join('?' * len(keys))})"
+        params += keys
+    return f"""
+        SELECT a.id, bm25(ads_fts) AS rank
+        FROM ads_fts
+        JOIN ads a ON a.id = ads_fts.rowid
+        WHERE ads_fts MATCH ? AND a.status = 'active' AND a.ad_type = 'found'
+          AND a.item_type = ? {location_filter}
+        ORDER BY rank
+        LIMIT ?
+    """, params + (limit,)
+
+@timed(db_seconds)
+async def search_fts(
+    text: str,
+    item_type: str,
+    location_key: Optional[str] = None,
+    limit: int = 200
+) -> List[Tuple[int, float]]:
+    """Активные находки, подходящие под текст: [(ad_id, bm25), ...], лучшие первыми."""
+    query = fts_query(text)
+    if query is None:
+        return []
+    async with db.read() as conn:
+        cursor = await conn.execute(*_search_fts_query(query, item_type, location_key, limit))
+        return await cursor.fetchall()
+
+# Утилиты: np.ndarray ↔ BLOB (формат см. в embedding_codec.py)
+def embedding_to_blob(embedding: np.ndarray) -> bytes:
+    return encode_embedding(embedding)
 
-# Утилита: из BLOB → np.ndarray
 def blob_to_embedding(blob: bytes) -> np.ndarray:
-    return np.frombuffer(blob, dtype=np.float32)
\ No newline at end of file
+    return decode_embedding(blob)
+
+# === СОХРАНЁННЫЕ ПОИСКИ ===
+LOST_REQUEST_TTL_DAYS = int(os.getenv("LOST_REQUEST_TTL_DAYS", 14))
+
+@timed(db_seconds)
+async def save_lost_request(
+    user_id: int,
+    chat_id: int,
+    item_type: str,
+    location_key: Optional[str],
+    embedding: np.ndarray,
+    seen_ad_ids: Sequence[int] = ()
+) -> int:
+    """
+    Сохраняет (или продлевает) поиск пользователя. Объявления, которые он уже
+    увидел в выдаче, сразу помечаются как отправленные, чтобы не дублировать.
+    """
+    async with db.write() as conn:
+        cursor = await conn.execute("""
+            INSERT INTO lost_requests (user_id, chat_id, item_type, location_key, embedding, expires_at)
+            VALUES (?, ?, ?, ?, ?, datetime('now', ?))
+            ON CONFLICT(user_id, item_type, location_key) DO UPDATE SET
+                chat_id = excluded.chat_id,
+                embedding = excluded.embedding,
+                expires_at = excluded.expires_at
+            RETURNING id
+        """, (
+            user_id, chat_id, item_type, location_key or "", embedding_to_blob(embedding),
+            f"+{LOST_REQUEST_TTL_DAYS} days"
+        ))
+        request_id = (await cursor.fetchone())[0]
+        await cursor.close()
+        if seen_ad_ids:
+            await conn.executemany(
+                "INSERT OR IGNORE INTO match_notifications (request_id, ad_id) VALUES (?, ?)",
+                [(request_id, ad_id) for ad_id in seen_ad_ids]
+            )
+    return request_id
+
+ACTIVE_LOST_REQUESTS = """
+    SELECT id, user_id, item_type, location_key, embedding
+    FROM lost_requests
+    WHERE expires_at > datetime('now')
+"""
+
+async def iter_active_lost_requests(batch_size: int = 1000):
+    """Пачки (id, user_id, item_type, location_key, embedding) действующих поисков."""
+    async with db.read() as conn:
+        cursor = await conn.execute(ACTIVE_LOST_REQUESTS)
+        while True:
+            rows = await cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+CLAIM_MATCH_NOTIFICATION = """
+    INSERT OR IGNORE INTO match_notifications (request_id, ad_id)
+    SELECT id, ? FROM lost_requests
+    WHERE id = ? AND expires_at > datetime('now')
+    RETURNING request_id
+"""
+
+def _request_chats_query(request_ids: Tuple[int, ...]) -> Tuple[str, tuple]:
+    return f"SELECT id, chat_id FROM lost_requests WHERE id IN ({','.join('?' * len(request_ids))})", request_ids
+
+@timed(db_seconds)
+async def claim_match_notifications(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+    """
+    Помечает пары (request_id, ad_id) как отправленные. Возвращает только новые
+    пары действующих поисков в виде (request_id, ad_id, chat_id) — их и нужно
+    уведомить; повторно та же пара не вернётся никогда.
+    """
+    if not pairs:
+        return []
+    claimed = []
+    async with db.write() as conn:
+        for request_id, ad_id in pairs:
+            cursor = await conn.execute(CLAIM_MATCH_NOTIFICATION, (ad_id, request_id))
+            inserted = await cursor.fetchone()
+            await cursor.close()
+            if inserted:
+                claimed.append((request_id, ad_id))
+        if not claimed:
+            return []
+        request_ids = tuple({request_id for request_id, _ in claimed})
+        cursor = await conn.execute(*_request_chats_query(request_ids))
+        chats = dict(await cursor.fetchall())
+    return [(request_id, ad_id, chats[request_id]) for request_id, ad_id in claimed]
+
+# === ВЕКТОРНЫЙ ИНДЕКС ===
+_index_lock = asyncio.Lock()
+
+ACTIVE_EMBEDDINGS = """
+    SELECT id, item_type, location_key, embedding
+    FROM ads
+    WHERE status = 'active' AND ad_type = 'found' AND embedding IS NOT NULL
+"""
+
+async def load_ad_index(batch_size: int = 1000):
+    """Загружает эмбеддинги активных находок в ad_index (один раз)."""
+    if ad_index.loaded:
+        return
+    async with _index_lock:
+        if ad_index.loaded:
+            return
+        skipped = 0
+        async with db.read() as conn:
+            # Поколения — до чтения ads: всё, что изменится позже, догонит sync_result_cache
+            cursor = await conn.execute("SELECT item_type, location_key, generation FROM ad_generations")
+            result_cache.reset_external(await cursor.fetchall())
+            cursor = await conn.execute(ACTIVE_EMBEDDINGS)
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for ad_id, item_type, loc, blob in rows:
+                    try:
+                        ad_index.add(ad_id, item_type, loc, blob_to_embedding(blob))
+                    except IncompatibleEmbedding:
+                        skipped += 1
+        if skipped:
+            logging.warning(f"⚠️ Пропущено эмбеддингов другой модели: {skipped}")
+        ad_index.loaded = True
+
+# === МИГРАЦИЯ ФОРМАТА ЭМБЕДДИНГОВ ===
+async def migrate_embeddings(dtype: str = EMBEDDING_DTYPE, batch_size: int = 500) -> int:
+    """
+    Переписывает эмбеддинги в формат dtype пачками по batch_size строк
+    (каждая пачка — своя транзакция). Возвращает число изменённых строк.
+    """
+    last_id = 0
+    rewritten = 0
+    while True:
+        async with db.read() as conn:
+            cursor = await conn.execute("""
+                SELECT id, embedding FROM ads
+                WHERE id > ? AND embedding IS NOT NULL
+                ORDER BY id
+                LIMIT ?
+            """, (last_id, batch_size))
+            rows = await cursor.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates = [
+            (encode_embedding(decode_embedding(blob), dtype), ad_id)
+            for ad_id, blob in rows
+            if needs_rewrite(blob, dtype)
+        ]
+        if updates:
+            async with db.write() as conn:
+                await conn.executemany("UPDATE ads SET embedding = ? WHERE id = ?", updates)
+            rewritten += len(updates)
+            logging.info(f"Перекодировано эмбеддингов: {rewritten} (id ≤ {last_id})")
+    return rewritten
+
+
+# === ПРОВЕРКА ПЛАНОВ ЗАПРОСОВ ===
+# Горячие запросы бота, обслуживания (maintenance.py) и админки (admin.py) с
+# типичными параметрами — SQL собирают те же функции, что и в работе.
+# python database.py check-plans и tests/test_query_plans.py падают, если
+# какой-то из них проходит таблицу целиком: «SCAN t» или «SCAN t USING INDEX i»
+# (индекс без ограничения читается весь). Последний элемент — таблицы, которые
+# запрос обходит намеренно: страница по индексу в порядке ORDER BY до LIMIT
+# или крошечный справочник.
+_LOC = "ФНАБА (Динамо)"
+
+def _admin_filters(status="Все", ad_type="Все", item="Все", location="Все", date_from=None, date_to=None):
+    return queries.history_tables(status), *queries.build_filters(status, ad_type, item, location, date_from, date_to)
+
+HOT_QUERIES: List[Tuple[str, str, tuple, Tuple[str, ...]]] = [
+    ("get_active_ads_by_type_and_location, корпус", *_active_ads_query("Ключи", _LOC, "found"), ()),
+    ("get_active_ads_by_type_and_location, «Не помню»", *_active_ads_query("Ключи", None, "found"), ()),
+    ("get_user_ads, активные", *_user_ads_query(1, "active"), ()),
+    ("get_user_ads, архив", *_user_ads_query(1, "archived"), ()),
+    ("get_ads_by_ids", *_ads_by_ids_query([1, 2, 3]), ()),
+    ("search_fts, корпус", *_search_fts_query('"ключ"*', "Ключи", _LOC, 200), ()),
+    ("search_fts, «Не помню»", *_search_fts_query('"ключ"*', "Ключи", None, 200), ()),
+    ("load_ad_index", ACTIVE_EMBEDDINGS, (), ()),
+    ("reload_ad_partition", PARTITION_EMBEDDINGS, ("Ключи", _LOC), ()),
+    ("sync_result_cache", "SELECT item_type, location_key, generation FROM ad_generations", (), ("ad_generations",)),
+    ("iter_active_lost_requests", ACTIVE_LOST_REQUESTS, (), ()),
+    ("claim_match_notifications", CLAIM_MATCH_NOTIFICATION, (1, 1), ()),
+    ("claim_match_notifications, чаты", *_request_chats_query((1, 2)), ()),
+    ("expire_old_ads", queries.EXPIRE_ADS, ("-30 days", 500), ()),
+    ("move_archived_ads", queries.ARCHIVED_AD_IDS, (500,), ()),
+    ("move_archived_ads, перенос", queries.move_to_archive(2)[0], (1, 2), ()),
+    ("purge_expired_lost_requests", queries.PURGE_LOST_REQUESTS, (), ()),
+    ("purge_expired_lost_requests, отметки", queries.PURGE_MATCH_NOTIFICATIONS, (1,), ()),
+    ("admin: число активных", *queries.count_query(*_admin_filters("active")), ()),
+    ("admin: число архивных по типу", *queries.count_query(*_admin_filters("archived", item="Ключи")), ()),
+    ("admin: число по корпусу", *queries.count_query(*_admin_filters(location=_LOC)), ()),
+    ("admin: первая страница", *queries.page_query(*_admin_filters(), None, 51), ("ads", "ads_archive")),
+    ("admin: страница по типу и дате",
+     *queries.page_query(*_admin_filters(item="Ключи", date_from=date(2024, 1, 1), date_to=date(2024, 1, 31)),
+                         ("2024-01-15 00:00:00", 10**9), 51), ()),
+    ("admin: страница по типу", *queries.page_query(*_admin_filters(item="Ключи"), None, 51), ()),
+    ("admin: страница по корпусу", *queries.page_query(*_admin_filters(location=_LOC), None, 51), ()),
+    ("admin: страница по корпусу, следующая",
+     *queries.page_query(*_admin_filters(location=_LOC), ("2024-01-15 00:00:00", 10**9), 51), ()),
+    ("admin: активные находки по корпусу, следующая страница",
+     *queries.page_query(*_admin_filters("active", "found", location=_LOC), ("2024-01-15 00:00:00", 10**9), 51),
+     ()),
+]
+
+# Таблица в FROM/JOIN и её псевдоним: в плане стоит псевдоним («SEARCH a …»)
+_SOURCE = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?=(?:\s+(?:AS\s+)?(\w+))?)", re.IGNORECASE)
+_NOT_ALIAS = {"WHERE", "JOIN", "ON", "INDEXED", "ORDER", "GROUP", "LIMIT", "LEFT", "INNER", "CROSS", "UNION"}
+
+def _aliases(sql: str) -> Dict[str, str]:
+    aliases = {}
+    for table, alias in _SOURCE.findall(sql):
+        if alias and alias.upper() not in _NOT_ALIAS:
+            aliases[alias] = table
+    return aliases
+
+def full_scan(detail: str, sql: str, tables: Iterable[str]) -> Optional[str]:
+    """Таблица, которую строка плана проходит целиком, или None."""
+    parts = detail.split()
+    if len(parts) < 2 or parts[0] != "SCAN" or "VIRTUAL TABLE" in detail:
+        return None  # SEARCH по индексу; FTS5 ищет по своему индексу
+    table = _aliases(sql).get(parts[1], parts[1])
+    # «SCAN (subquery-1)», «SCAN CONSTANT ROW» — не таблицы
+    return table if table in tables else None
+
+async def check_query_plans() -> List[str]:
+    """Запросы из HOT_QUERIES, план которых проходит таблицу или индекс целиком."""
+    problems = []
+    async with db.read() as conn:
+        cursor = await conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        tables = {row[0] for row in await cursor.fetchall()}
+        for name, sql, params, allowed in HOT_QUERIES:
+            cursor = await conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            for *_, detail in await cursor.fetchall():
+                table = full_scan(detail, sql, tables)
+                if table is not None and table not in allowed:
+                    problems.append(f"{name}: {detail}")
+    return problems
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:2] == ["migrate-embeddings"]:
+        target = sys.argv[2] if len(sys.argv) > 2 else EMBEDDING_DTYPE
+
+        async def _main():
+            try:
+                count = await migrate_embeddings(target)
+                print(f"✅ Перекодировано: {count}")
+            finally:
+                await close_db()
+
+        asyncio.run(_main())
+    elif sys.argv[1:2] == ["check-plans"]:
+
+        async def _check() -> List[str]:
+            try:
+                await init_db()
+                return await check_query_plans()
+            finally:
+                await close_db()
+
+        problems = asyncio.run(_check())
+        for problem in problems:
+            print(f"❌ {problem}")
+        if problems:
+            sys.exit(1)
+        print(f"✅ Планы {len(HOT_QUERIES)} запросов без полного прохода по таблицам")
+    else:
+        print("Использование: python database.py migrate-embeddings [float32|float16|int8] | check-plans")
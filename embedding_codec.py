@@ -0,0 +1,109 @@
+"""
+Формат хранения эмбеддингов в колонке ads.embedding.
+
+BLOB = заголовок + вектор. Заголовок (14 байт, little-endian):
+    magic    2s   b"EM"
+    version  B    1
+    dtype    B    1 = float32, 2 = float16, 3 = int8 (скалярное квантование)
+    dim      H    размерность
+    model    I    crc32 от id модели
+    scale    f    множитель для int8 (для остальных 1.0)
+
+Старые записи (голый float32 без заголовка) читаются как float32 от
+MODEL_NAME — их можно переписать командой `python database.py migrate-embeddings`.
+"""
+import os
+import struct
+import zlib
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from encoders import MODEL_NAME
+
+MAGIC = b"EM"
+VERSION = 1
+HEADER = struct.Struct("<2sBBHIf")
+
+DTYPES = {
+    "float32": (1, np.float32),
+    "float16": (2, np.float16),
+    "int8": (3, np.int8),
+}
+DTYPE_NAMES = {code: name for name, (code, _) in DTYPES.items()}
+
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float16")
+
+
+class IncompatibleEmbedding(ValueError):
+    """Вектор получен другой моделью или в неизвестном формате."""
+
+
+class EmbeddingInfo(NamedTuple):
+    dtype: str
+    dim: int
+    model_tag: int
+    scale: float
+    legacy: bool
+
+
+def model_tag(model_id: str = MODEL_NAME) -> int:
+    return zlib.crc32(model_id.encode())
+
+
+def encode_embedding(
+    vec: np.ndarray,
+    dtype: str = EMBEDDING_DTYPE,
+    model_id: str = MODEL_NAME
+) -> bytes:
+    """np.ndarray → BLOB с заголовком."""
+    if dtype not in DTYPES:
+        raise ValueError(f"Неизвестный формат эмбеддинга: {dtype}")
+    code, np_dtype = DTYPES[dtype]
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    scale = 1.0
+    if dtype == "int8":
+        peak = float(np.abs(vec).max()) if vec.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        payload = np.clip(np.rint(vec / scale), -127, 127).astype(np.int8)
+    else:
+        payload = vec.astype(np_dtype)
+    header = HEADER.pack(MAGIC, VERSION, code, vec.size, model_tag(model_id), scale)
+    return header + payload.tobytes()
+
+
+def embedding_info(blob: bytes) -> EmbeddingInfo:
+    """Читает заголовок BLOB, не декодируя сам вектор."""
+    if len(blob) >= HEADER.size and blob[:2] == MAGIC:
+        magic, version, code, dim, tag, scale = HEADER.unpack_from(blob)
+        if version == VERSION and code in DTYPE_NAMES:
+            itemsize = np.dtype(DTYPES[DTYPE_NAMES[code]][1]).itemsize
+            if len(blob) == HEADER.size + dim * itemsize:
+                return EmbeddingInfo(DTYPE_NAMES[code], dim, tag, scale, False)
+    if len(blob) % 4:
+        raise IncompatibleEmbedding("Неизвестный формат эмбеддинга")
+    return EmbeddingInfo("float32", len(blob) // 4, model_tag(), 1.0, True)
+
+
+def decode_embedding(blob: bytes, model_id: Optional[str] = MODEL_NAME) -> np.ndarray:
+    """
+    BLOB → float32 вектор. Если model_id задан, а вектор получен другой
+    моделью, бросает IncompatibleEmbedding.
+    """
+    info = embedding_info(blob)
+    if info.legacy:
+        return np.frombuffer(blob, dtype=np.float32)
+    if model_id is not None and info.model_tag != model_tag(model_id):
+        raise IncompatibleEmbedding("Эмбеддинг получен другой моделью")
+    payload = np.frombuffer(blob, dtype=DTYPES[info.dtype][1], offset=HEADER.size)
+    if info.dtype == "int8":
+        return payload.astype(np.float32) * np.float32(info.scale)
+    return payload.astype(np.float32, copy=False)
+
+
+def needs_rewrite(blob: bytes, dtype: str = EMBEDDING_DTYPE, model_id: str = MODEL_NAME) -> bool:
+    """Нужно ли перекодировать BLOB в формат dtype (без смены модели)."""
+    info = embedding_info(blob)
+    if info.model_tag != model_tag(model_id):
+        return False  # тут поможет только перекодирование текста моделью
+    return info.legacy or info.dtype != dtype
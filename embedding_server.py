@@ -0,0 +1,83 @@
+"""
+Общий сервер эмбеддингов: одна копия модели на все процессы бота.
+
+Запуск: python embedding_server.py [адрес]
+Адрес — EMBEDDING_SERVER (по умолчанию unix:/tmp/whereismy-embeddings.sock),
+можно http://127.0.0.1:8765. Воркеры бота подключаются к нему с
+ENCODER_BACKEND=remote (см. encoders.py).
+
+POST /encode {"texts": [...]} → сырые float32 (len(texts), dim), размерность
+в заголовке X-Embedding-Dim. Запросы всех клиентов собираются в общие батчи
+тем же BatchEncoder, что и в боте.
+"""
+import asyncio
+import logging
+import os
+import sys
+
+import numpy as np
+from aiohttp import web
+
+from encoders import EMBEDDING_SERVER, local_backend
+from metrics import inference_seconds, metrics_handler, registry, timed
+from search import BatchEncoder
+
+MAX_TEXTS = 256
+MAX_TEXT_LENGTH = 2000
+
+
+def create_app(warm_up: bool = True) -> web.Application:
+    backend = local_backend()
+    encoder = BatchEncoder(timed(inference_seconds, "server_encode_batch")(backend.encode))
+
+    async def encode(request: web.Request) -> web.Response:
+        try:
+            texts = (await request.json())["texts"]
+        except (ValueError, KeyError, TypeError):
+            raise web.HTTPBadRequest(text='Ожидается JSON {"texts": [...]}')
+        if not isinstance(texts, list) or len(texts) > MAX_TEXTS or not all(isinstance(t, str) for t in texts):
+            raise web.HTTPBadRequest(text=f"texts — список строк, не больше {MAX_TEXTS}")
+        vectors = await asyncio.gather(*(encoder.encode(t[:MAX_TEXT_LENGTH]) for t in texts))
+        matrix = np.ascontiguousarray(np.stack(vectors) if vectors else np.zeros((0, 384)), dtype=np.float32)
+        return web.Response(
+            body=matrix.tobytes(),
+            content_type="application/octet-stream",
+            headers={"X-Embedding-Dim": str(matrix.shape[1])}
+        )
+
+    async def ping(request: web.Request) -> web.Response:
+        return web.Response(text="OK" if backend.loaded else "LOADING")
+
+    async def on_startup(app: web.Application):
+        if warm_up:
+            # Модель грузится сразу, а не на первом запросе клиента
+            await asyncio.get_running_loop().run_in_executor(None, backend.load)
+
+    async def on_cleanup(app: web.Application):
+        await encoder.close()
+
+    registry.gauge("embedding_server_queue_depth", "Тексты в очереди сервера эмбеддингов", lambda: encoder.queue_depth)
+    app = web.Application(client_max_size=4 * 1024 * 1024)
+    app.router.add_post("/encode", encode)
+    app.router.add_get("/ping", ping)
+    app.router.add_get("/metrics", metrics_handler)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def serve(address: str = EMBEDDING_SERVER):
+    app = create_app()
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.unlink(path)  # сокет от прошлого запуска
+        web.run_app(app, path=path)
+    else:
+        host, _, port = address.split("://", 1)[-1].rstrip("/").partition(":")
+        web.run_app(app, host=host or "127.0.0.1", port=int(port or 8765))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve(sys.argv[1] if len(sys.argv) > 1 else EMBEDDING_SERVER)
@@ -0,0 +1,302 @@
+"""
+Бэкенды для кодирования текста в эмбеддинги.
+
+Модель загружается лениво, при первом обращении, поэтому импорт search.py
+больше не тянет torch и бот начинает отвечать сразу. Бэкенд выбирается
+переменной ENCODER_BACKEND:
+
+- torch — SentenceTransformer (по умолчанию);
+- onnx  — ONNX Runtime на CPU, обычно с int8-квантованной моделью.
+  Модель готовится один раз командой `python encoders.py export-onnx`
+  (нужны torch и onnxruntime), для работы бота достаточно onnxruntime
+  и tokenizers;
+- remote — общий сервер эмбеддингов (embedding_server.py) по адресу
+  EMBEDDING_SERVER: модель держится в одном процессе на всех воркеров.
+  Если сервер недоступен, кодирует локально бэкендом ENCODER_FALLBACK
+  (пустое значение — не кодировать, а падать с ошибкой).
+"""
+import http.client
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+MAX_SEQ_LENGTH = 256
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx_model")
+ONNX_MODEL_FILE = "model.int8.onnx"
+# unix:/путь/к/сокету или http://127.0.0.1:8765
+EMBEDDING_SERVER = os.getenv("EMBEDDING_SERVER", "unix:/tmp/whereismy-embeddings.sock")
+ENCODER_FALLBACK = os.getenv("ENCODER_FALLBACK", "torch")
+REMOTE_TIMEOUT = float(os.getenv("EMBEDDING_SERVER_TIMEOUT", 10))
+REMOTE_RETRY_AFTER = 30  # секунд работы на fallback после отказа сервера
+
+
+class EncoderBackend:
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @property
+    def model_id(self) -> str:
+        return f"{MODEL_NAME}/{self.name}"
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self):
+        """Загружает модель (один раз, потокобезопасно)."""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            logging.info(f"🔍 Загружаем модель для векторного поиска ({self.name})...")
+            self._load()
+            self._loaded = True
+            logging.info("✅ Модель загружена.")
+
+    def _load(self):
+        raise NotImplementedError
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Возвращает матрицу (len(texts), 384) нормированных float32 векторов."""
+        self.load()
+        return self._encode(texts)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class TorchBackend(EncoderBackend):
+    name = "torch"
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(MODEL_NAME, device='cpu')
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, convert_to_numpy=True, batch_size=max(1, len(texts)))
+
+
+class OnnxBackend(EncoderBackend):
+    """
+    ONNX Runtime + токенизатор HuggingFace. Повторяет пайплайн
+    SentenceTransformer (mean pooling + L2-нормализация), поэтому векторы
+    совместимы с уже сохранёнными в базе.
+    """
+    name = "onnx"
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR):
+        super().__init__()
+        self.model_dir = model_dir
+
+    def _load(self):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError("❌ Для ENCODER_BACKEND=onnx нужны пакеты onnxruntime и tokenizers") from e
+
+        tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+        tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        tokenizer.enable_padding()
+        self.tokenizer = tokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = int(os.getenv("ONNX_THREADS", os.cpu_count() or 1))
+        self.session = ort.InferenceSession(
+            os.path.join(self.model_dir, ONNX_MODEL_FILE),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, 384), dtype=np.float32)
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling по реальным токенам + нормализация, как в SentenceTransformer
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class RemoteEncoderError(RuntimeError):
+    """Сервер эмбеддингов ответил, но не векторами (ошибка, битый ответ)."""
+
+
+class RemoteBackend(EncoderBackend):
+    """
+    Клиент сервера эмбеддингов. Тексты уходят одним POST /encode, ответ —
+    сырые float32 (len(texts), dim). Соединение keep-alive переиспользуется.
+    """
+    name = "remote"
+
+    def __init__(self, address: str = EMBEDDING_SERVER, fallback: str = ENCODER_FALLBACK):
+        super().__init__()
+        self.address = address
+        self.fallback_name = fallback
+        self._fallback: Optional[EncoderBackend] = None
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._conn_lock = threading.Lock()
+        self._down_until = 0.0
+
+    @property
+    def model_id(self) -> str:
+        # Векторы те же, что у локальной модели сервера
+        return f"{MODEL_NAME}/{self.fallback_name or 'torch'}"
+
+    def load(self):
+        self._loaded = True  # модель живёт на сервере; fallback загрузится при первом отказе
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.address.startswith("unix:"):
+            return _UnixHTTPConnection(self.address[len("unix:"):], REMOTE_TIMEOUT)
+        host = self.address.split("://", 1)[-1].rstrip("/")
+        return http.client.HTTPConnection(host, timeout=REMOTE_TIMEOUT)
+
+    def _request(self, texts: List[str]) -> np.ndarray:
+        body = json.dumps({"texts": texts}, ensure_ascii=False).encode()
+        with self._conn_lock:
+            for attempt in range(2):  # повтор — если сервер закрыл keep-alive соединение
+                if self._conn is None:
+                    self._conn = self._connect()
+                try:
+                    self._conn.request("POST", "/encode", body, {"Content-Type": "application/json"})
+                    response = self._conn.getresponse()
+                    data = response.read()
+                except (OSError, http.client.HTTPException):
+                    self._conn.close()
+                    self._conn = None
+                    if attempt:
+                        raise
+                    continue
+                if response.status != 200:
+                    raise RemoteEncoderError(f"Сервер эмбеддингов ответил {response.status}: {data[:200]!r}")
+                try:
+                    dim = int(response.getheader("X-Embedding-Dim"))
+                    return np.frombuffer(data, dtype=np.float32).reshape(len(texts), dim)
+                except (TypeError, ValueError):
+                    raise RemoteEncoderError(
+                        f"Некорректный ответ сервера эмбеддингов: X-Embedding-Dim="
+                        f"{response.getheader('X-Embedding-Dim')!r}, {len(data)} байт"
+                    ) from None
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if not self.fallback_name or time.monotonic() >= self._down_until:
+            try:
+                return self._request(texts)
+            except (OSError, http.client.HTTPException, RemoteEncoderError) as e:
+                if not self.fallback_name:
+                    raise
+                logging.warning(f"⚠️ Сервер эмбеддингов недоступен ({e}), кодируем локально")
+                self._down_until = time.monotonic() + REMOTE_RETRY_AFTER
+        if self._fallback is None:
+            self._fallback = BACKENDS[self.fallback_name]()
+        return self._fallback.encode(texts)
+
+
+BACKENDS = {
+    "torch": TorchBackend,
+    "onnx": OnnxBackend,
+    "remote": RemoteBackend,
+}
+
+_backend: Optional[EncoderBackend] = None
+_backend_lock = threading.Lock()
+
+def get_backend() -> EncoderBackend:
+    """Выбранный бэкенд (создаётся без загрузки модели)."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if ENCODER_BACKEND not in BACKENDS:
+                    raise RuntimeError(f"❌ Неизвестный ENCODER_BACKEND: {ENCODER_BACKEND}")
+                _backend = BACKENDS[ENCODER_BACKEND]()
+    return _backend
+
+
+def local_backend() -> EncoderBackend:
+    """Бэкенд с моделью в этом процессе (для сервера эмбеддингов)."""
+    if ENCODER_BACKEND != "remote":
+        return get_backend()
+    return BACKENDS[ENCODER_FALLBACK or "torch"]()
+
+
+def export_onnx(model_dir: str = ONNX_MODEL_DIR):
+    """
+    Экспортирует MiniLM в ONNX и квантует веса в int8 (dynamic quantization).
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(model_dir, exist_ok=True)
+    st_model = SentenceTransformer(MODEL_NAME, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    st_model.tokenizer.save_pretrained(model_dir)
+
+    sample = st_model.tokenizer(["пример текста"], return_tensors="pt")
+    fp32_path = os.path.join(model_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "seq"},
+                "attention_mask": {0: "batch", 1: "seq"},
+                "token_type_ids": {0: "batch", 1: "seq"},
+                "last_hidden_state": {0: "batch", 1: "seq"},
+            },
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, os.path.join(model_dir, ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+
+    # Проверяем, что квантованная модель даёт близкие векторы
+    texts = ["Ключи", "Карту-пропуск нашёл у гардероба", "Повербанк"]
+    reference = st_model.encode(texts, convert_to_numpy=True)
+    quantized = OnnxBackend(model_dir).encode(texts)
+    similarity = (reference * quantized).sum(axis=1)
+    print(f"✅ ONNX-модель сохранена в {model_dir}, косинус с оригиналом: {similarity.round(4).tolist()}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["export-onnx"]:
+        export_onnx(sys.argv[2] if len(sys.argv) > 2 else ONNX_MODEL_DIR)
+    else:
+        print("Использование: python encoders.py export-onnx [папка]")
@@ -0,0 +1,26 @@
+from datetime import datetime
+
+from models import Ad
+
+
+def format_ad_message(ad: Ad, is_owner=False) -> str:
+    ad_type, item_type, desc, status = ad.ad_type, ad.item_type, ad.description, ad.status
+    loc, place, c_type, c_info = ad.location_key, ad.place_detail, ad.contact_type, ad.contact_info
+    emoji = "🔍" if ad_type == "found" else "❓"
+    status_label = "✅ АКТИВНОЕ" if status == "active" else "⏹ АРХИВ"
+    place_line = f" — {place}" if place else ""
+    contact_line = ""
+    if c_type == "drop":
+        contact_line = f"📥 Оставил в: {c_info}"
+    else:
+        contact_line = f"📞 Связаться: {c_info}"
+
+    dt = datetime.fromisoformat(ad.created_at).strftime("%d.%m.%Y")
+    msg = f"[{status_label}] {emoji} {ad_type == 'found' and 'Нашёл' or 'Потерял'}: {item_type}\n"
+    msg += f"📍 {loc}{place_line}\n"
+    if desc:
+        msg += f"📝 {desc}\n"
+    msg += f"{contact_line}"
+    if status == "archived":
+        msg += f"\n⏹ Завершено {dt}"
+    return msg
@@ -0,0 +1,217 @@
+"""
+FSM-хранилище aiogram в SQLite с кэшем, версиями строк и отложенной записью.
+
+Состояния FoundFlow/LostFlow переживают перезапуск и доступны нескольким
+процессам бота. Брошенные сценарии удаляются через FSM_TTL секунд после
+последнего изменения.
+
+У каждой строки есть версия, запись — compare-and-set: изменение,
+сделанное поверх чужой более новой версии, не применяется, а запись
+выкидывается из кэша и перечитывается.
+
+Один воркер (BOT_WORKERS=1, по умолчанию): чтения идут из кэша процесса
+(запись свежа FSM_CACHE_TTL секунд), записи копятся и сбрасываются одной
+транзакцией раз в FSM_FLUSH_INTERVAL. Несколько воркеров: запись сквозная
+(set_state возвращается после коммита), а каждое чтение сверяет версию с
+БД — JSON разбирается заново, только если строку поменял другой воркер.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+from database import Database, db as default_db
+
+FSM_TTL = float(os.getenv("FSM_TTL", 24 * 3600))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", 2))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 0.1))
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
+FSM_CACHE_MAX = 50000
+CLEANUP_INTERVAL = 600
+
+
+class _Record:
+    __slots__ = ("state", "data", "version", "loaded_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], version: int, loaded_at: float):
+        self.state = state
+        self.data = data
+        self.version = version  # 0 — строки в БД нет
+        self.loaded_at = loaded_at
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(
+        self,
+        database: Database = default_db,
+        ttl: float = FSM_TTL,
+        cache_ttl: float = FSM_CACHE_TTL,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        shared: bool = BOT_WORKERS > 1
+    ):
+        self.db = database
+        self.ttl = ttl
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.shared = shared
+        self.conflicts = 0
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: Dict[str, _Record] = {}
+        self._dirty: set = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._table_ready = False
+        self._last_cleanup = time.monotonic()
+
+    async def _ensure_table(self):
+        if self._table_ready:
+            return
+        async with self.db.write() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_state (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    expires_at REAL NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 1
+                )
+            """)
+            cursor = await conn.execute("SELECT 1 FROM pragma_table_info('fsm_state') WHERE name = 'version'")
+            if await cursor.fetchone() is None:  # таблица от прежней версии
+                await conn.execute("ALTER TABLE fsm_state ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_expires ON fsm_state(expires_at)")
+        self._table_ready = True
+
+    async def _record(self, key: StorageKey) -> _Record:
+        k = self.key_builder.build(key)
+        record = self._cache.get(k)
+        now = time.monotonic()
+        if record is not None and (
+            k in self._dirty or (not self.shared and now - record.loaded_at < self.cache_ttl)
+        ):
+            return record
+
+        await self._ensure_table()
+        async with self.db.read() as conn:
+            cursor = await conn.execute(
+                "SELECT version, state, data FROM fsm_state WHERE key = ? AND expires_at > ?",
+                (k, time.time())
+            )
+            row = await cursor.fetchone()
+        # Пока читали, запись могли изменить в этом же процессе
+        if k in self._dirty:
+            return self._cache[k]
+        version = row[0] if row else 0
+        if record is not None and record.version == version:
+            record.loaded_at = now  # другие воркеры строку не меняли
+            return record
+        record = _Record(row[1], json.loads(row[2]), version, now) if row else _Record(None, {}, 0, now)
+        if len(self._cache) >= FSM_CACHE_MAX:
+            self._evict()
+        self._cache[k] = record
+        return record
+
+    def _evict(self):
+        """Выкидывает из кэша все чистые записи (они есть в БД)."""
+        for k in [k for k in self._cache if k not in self._dirty]:
+            del self._cache[k]
+
+    async def _touch(self, key: StorageKey, record: _Record):
+        k = self.key_builder.build(key)
+        record.loaded_at = time.monotonic()
+        self._cache[k] = record
+        self._dirty.add(k)
+        if self.shared:
+            await self.flush()  # сквозная запись: другой воркер прочитает уже новое
+        elif self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Сбрасываем пачкой: изменения за интервал коалесцируются в одну транзакцию
+        while self._dirty:
+            if self.flush_interval > 0:
+                await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Ошибка записи FSM в БД: {e}")
+                return
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        await self._ensure_table()
+        dirty, self._dirty = self._dirty, set()
+        expires_at = time.time() + self.ttl
+        # Снимок: пока идёт запись, обработчики могут менять записи дальше
+        pending = []
+        for k in dirty:
+            record = self._cache.get(k)
+            if record is not None:
+                pending.append((k, record, record.state, json.dumps(record.data, ensure_ascii=False), record.version))
+        written, conflicts = [], []
+        try:
+            async with self.db.write() as conn:
+                for k, record, state, data, version in pending:
+                    if state is None and data == "{}":
+                        if version == 0:
+                            row = (0,)  # строки в БД и не было
+                        else:
+                            cursor = await conn.execute(
+                                "DELETE FROM fsm_state WHERE key = ? AND version = ? RETURNING 0", (k, version)
+                            )
+                            row = await cursor.fetchone()
+                            await cursor.close()
+                    else:
+                        # Обновляем, только если с нашего чтения строку никто не менял
+                        # (просроченная строка для нас не существует — её можно перезаписать)
+                        cursor = await conn.execute("""
+                            INSERT INTO fsm_state (key, state, data, expires_at) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(key) DO UPDATE SET
+                                state = excluded.state, data = excluded.data,
+                                expires_at = excluded.expires_at, version = fsm_state.version + 1
+                            WHERE fsm_state.version = ? OR fsm_state.expires_at <= ?
+                            RETURNING version
+                        """, (k, state, data, expires_at, version, time.time()))
+                        row = await cursor.fetchone()
+                        await cursor.close()
+                    (written if row else conflicts).append((k, record, row[0] if row else None))
+                if time.monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+                    await conn.execute("DELETE FROM fsm_state WHERE expires_at <= ?", (time.time(),))
+                    self._last_cleanup = time.monotonic()
+        except BaseException:
+            self._dirty |= dirty  # повторим при следующем сбросе
+            raise
+        for k, record, version in written:
+            record.version = version
+        for k, record, _ in conflicts:
+            # Другой воркер успел записать более новую версию: она и остаётся
+            self.conflicts += 1
+            logging.warning(f"FSM: конфликт версий для {k}, состояние перечитается из БД")
+            if k not in self._dirty and self._cache.get(k) is record:
+                del self._cache[k]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        await self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = data.copy()
+        await self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key)).data.copy()
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
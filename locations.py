@@ -0,0 +1,73 @@
+"""
+Модель локаций: здания и близость корпусов.
+
+Несколько факультетов делят один адрес (ФНАБА и ВШУ на Динамо, ФМЭО и
+ФСНиМК на Аэропорте, Финансовый и ИОО на Филёвском парке), поэтому вещь,
+потерянную «в ВШУ», могли оформить под ФНАБА. Всё считается один раз при
+загрузке модуля: группы по зданию и таблица близости exp(-расстояние / LOCATION_SCALE_KM)
+между всеми парами корпусов (1 — одно здание).
+
+Поиск по корпусу берёт кандидатов из всех корпусов с близостью не ниже
+LOCATION_MIN_PROXIMITY, а к косинусу добавляет LOCATION_WEIGHT × близость:
+свой корпус и соседи по зданию выше, соседние здания — чуть ниже.
+"""
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+from constants import BUILDING_COORDS, LOCATIONS
+
+LOCATION_SCALE_KM = float(os.getenv("LOCATION_SCALE_KM", 2))
+LOCATION_MIN_PROXIMITY = float(os.getenv("LOCATION_MIN_PROXIMITY", 0.25))
+LOCATION_WEIGHT = float(os.getenv("LOCATION_WEIGHT", 0.1))
+
+
+def distance_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Расстояние по поверхности Земли (гаверсинус)."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 12742 * math.asin(math.sqrt(h))
+
+
+# Корпус → здание (адрес) и здание → корпуса
+BUILDING_OF: Dict[str, str] = dict(LOCATIONS)
+BUILDINGS: Dict[str, List[str]] = {}
+for _key, _address in LOCATIONS.items():
+    BUILDINGS.setdefault(_address, []).append(_key)
+
+# Близость каждой пары корпусов, по убыванию
+PROXIMITY: Dict[str, Dict[str, float]] = {}
+for _key, _address in LOCATIONS.items():
+    _row = {}
+    for _other, _other_address in LOCATIONS.items():
+        if _address == _other_address:
+            _row[_other] = 1.0
+        elif _address in BUILDING_COORDS and _other_address in BUILDING_COORDS:
+            _km = distance_km(BUILDING_COORDS[_address], BUILDING_COORDS[_other_address])
+            _row[_other] = math.exp(-_km / LOCATION_SCALE_KM)
+        else:
+            _row[_other] = 0.0
+    PROXIMITY[_key] = dict(sorted(_row.items(), key=lambda item: -item[1]))
+
+
+def co_located(location_key: str) -> List[str]:
+    """Все корпуса в том же здании (включая сам корпус)."""
+    return BUILDINGS.get(BUILDING_OF.get(location_key), [location_key])
+
+
+def nearby(location_key: Optional[str], min_proximity: float = LOCATION_MIN_PROXIMITY) -> Dict[str, float]:
+    """
+    Корпуса-кандидаты с их близостью к location_key. Без корпуса («Не помню») —
+    все корпуса с одинаковым весом, и порядок задаёт только сходство.
+    """
+    if not location_key:
+        return {key: 0.0 for key in LOCATIONS}
+    row = PROXIMITY.get(location_key)
+    if row is None:
+        return {location_key: 1.0}
+    return {key: p for key, p in row.items() if p >= min_proximity}
+
+
+def location_bias(location_key: Optional[str], weight: float = LOCATION_WEIGHT) -> Dict[str, float]:
+    """Надбавка к косинусу для каждого корпуса-кандидата."""
+    return {key: weight * p for key, p in nearby(location_key).items()}
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 from datetime import datetime
 from aiogram import Bot, Dispatcher, Router, F
@@ -6,17 +7,33 @@ from aiogram.types import (
     Message, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.filters import CommandStart
 from dotenv import load_dotenv
 
 from database import (
-    init_db, ensure_user, create_ad, get_active_ads_by_type_and_location,
-    get_user_ads, archive_ad, blob_to_embedding, get_ad_by_id
+    init_db, ensure_user, create_ad, get_user_ads, archive_ad, get_ads_by_ids,
+    load_ad_index, open_db, close_db, save_lost_request, search_fts, sync_result_cache
 )
-from search import encode_text, rank_ads_by_query
+from search import (
+    encode_text_async, encode_query_async, encoder, warm_up,
+    search_cursors, hybrid_rank, search_nearby
+)
+from vector_index import ad_index
+from constants import ITEM_TYPES, LOCATIONS, LOCATION_CHOICES
+from formatting import format_ad_message
+from metrics import (
+    HandlerTimingMiddleware, TelegramTimingMiddleware, metrics_handler,
+    monitor_loop_lag, registry
+)
+from search import query_cache
+from result_cache import result_cache
+from sender import OutboundScheduler
+from fsm_storage import SQLiteStorage
+from matching import MatchWorker
+from maintenance import MaintenanceScheduler
+from updates import UpdateScheduler
 
 # === НАСТРОЙКИ ===
 load_dotenv()
@@ -26,27 +43,20 @@ if not BOT_TOKEN:
     raise RuntimeError("❌ BOT_TOKEN не задан в .env!")
 
 bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+dp = Dispatcher(storage=SQLiteStorage())
+updates = UpdateScheduler()
+dp.update.outer_middleware(updates)
 router = Router()
+outbox = OutboundScheduler(bot)
+matcher = MatchWorker(
+    lambda chat_id, ad: outbox.send(chat_id, "🔔 Возможно, нашли вашу вещь:\n\n" + format_ad_message(ad))
+)
+maintenance = MaintenanceScheduler(on_requests_purged=matcher.remove_requests)
 
 # === КОНСТАНТЫ ===
-ITEM_TYPES = [
-    "Карту-пропуск", "Гардеробный номерок", "Ключи",
-    "Повербанк", "Зонтик", "Кошелёк", "Другое…"
-]
-LOCATIONS = {
-    "ФЭБ (ВДНХ)": "м. ВДНХ, ул. Кибальчича, д. 1, стр. 2",
-    "Финансовый (Китай-город)": "м. Китай-город, Малый Златоустинский пер., д. 7, стр. 1",
-    "Финансовый (Филёвский парк)": "м. Филёвский парк, ул. Олеко Дундича, д. 23",
-    "ФНАБА (Динамо)": "м. Динамо, ул. Верхняя Масловка, д. 15",
-    "ФМЭО (Аэропорт)": "м. Аэропорт, Ленинградский просп., д. 49",
-    "ВШУ (Динамо)": "м. Динамо, ул. Верхняя Масловка, д. 15",
-    "Юрфак (Семёновская)": "м. Семёновская, ул. Щербаковская, д. 38",
-    "ФСНиМК (Аэропорт)": "м. Аэропорт, Ленинградский просп., д. 49",
-    "ИТиАБД (Рязанский просп.)": "м. Рязанский проспект, 4-й Вешняковский пр., д. 4",
-    "ИОО (Филёвский парк)": "м. Филёвский парк, ул. Олеко Дундича, д. 23"
-}
-LOCATION_CHOICES = list(LOCATIONS.keys()) + ["Не помню"]
+SEARCH_PAGE_SIZE = 5
+SEARCH_MAX_RESULTS = 50  # сколько id держим в курсоре выдачи
+FTS_SHORTLIST = 200      # кандидатов от полнотекстового поиска для векторного этапа
 
 # === FSM ===
 class FoundFlow(StatesGroup):
@@ -60,6 +70,7 @@ class FoundFlow(StatesGroup):
 class LostFlow(StatesGroup):
     type = State()
     location = State()
+    query = State()  # необязательное описание своими словами
     # далее — просмотр или создание
 
 # === КЛАВИАТУРЫ ===
@@ -97,39 +108,59 @@ def contact_type_kb():
         [InlineKeyboardButton(text="Свяжитесь со мной", callback_data="contact_type:contact")]
     ])
 
+def more_results_kb(token: str, offset: int):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Показать ещё", callback_data=f"more:{token}:{offset}")]
+    ])
+
 def archive_kb(ad_id: int):
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⏹️ Завершить", callback_data=f"archive:{ad_id}")]
     ])
 
 # === ВСПОМОГАТЕЛЬНЫЕ ===
-def format_ad_message(ad_row, is_owner=False) -> str:
-    ad_id, user_id, ad_type, item_type, desc, photo, loc, place, c_type, c_info, _, status, created = ad_row
-    emoji = "🔍" if ad_type == "found" else "❓"
-    status_label = "✅ АКТИВНОЕ" if status == "active" else "⏹ АРХИВ"
-    place_line = f" — {place}" if place else ""
-    contact_line = ""
-    if c_type == "drop":
-        contact_line = f"📥 Оставил в: {c_info}"
+async def render_ads(ad_ids):
+    """
+    {ad_id: текст} ещё активных объявлений из ad_ids. Тех, кого уже нет в БД
+    (сняты в другом процессе), убираем из индекса и кэша выдач.
+    """
+    await sync_result_cache()
+    rendered = await result_cache.render(ad_ids, get_ads_by_ids)
+    gone = [ad_id for ad_id in ad_ids if ad_id not in rendered]
+    if gone:
+        for ad_id in gone:
+            ad_index.remove(ad_id)
+        result_cache.forget(gone)
+    return rendered
+
+async def send_results_page(message: Message, cursor, offset: int, texts=None):
+    """Одна страница выдачи одним сообщением (+ кнопка, если есть ещё)."""
+    if texts is None:
+        texts = list((await render_ads(cursor.ad_ids[offset:offset + SEARCH_PAGE_SIZE])).values())
+    next_offset = offset + SEARCH_PAGE_SIZE
+    has_more = next_offset < len(cursor.ad_ids)
+
+    total = len(cursor.ad_ids)
+    text = f"🔎 Результаты {offset + 1}–{min(next_offset, total)} из {total}:\n\n"
+    if texts:
+        text += "\n\n".join(texts)
     else:
-        contact_line = f"📞 Связаться: {c_info}"
-
-    dt = datetime.fromisoformat(created).strftime("%d.%m.%Y")
-    msg = f"[{status_label}] {emoji} {ad_type == 'found' and 'Нашёл' or 'Потерял'}: {item_type}\n"
-    msg += f"📍 {loc}{place_line}\n"
-    if desc:
-        msg += f"📝 {desc}\n"
-    msg += f"{contact_line}"
-    if status == "archived":
-        msg += f"\n⏹ Завершено {dt}"
-    return msg
+        text += "Эти объявления уже завершены."
+    if not has_more:
+        text += "\n\nНашли свою вещь? Свяжитесь с автором объявления."
+    outbox.send(
+        message.chat.id,
+        text,
+        reply_markup=more_results_kb(cursor.token, next_offset) if has_more else None
+    )
 
 # === ОБРАБОТЧИКИ ===
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
     await ensure_user(message.from_user.id)
-    await message.answer(
+    outbox.send(
+        message.chat.id,
         "🎓 *WhereIsMy* — бот для поиска потерянных вещей в корпусах университета.\n\n"
         "Выберите действие:",
         reply_markup=main_menu_kb(),
@@ -140,13 +171,13 @@ async def cmd_start(message: Message, state: FSMContext):
 @router.message(F.text == "🔍 Нашёл")
 async def found_start(message: Message, state: FSMContext):
     await state.set_state(FoundFlow.type)
-    await message.answer("Что вы нашли?", reply_markup=item_type_kb())
+    outbox.send(message.chat.id, "Что вы нашли?", reply_markup=item_type_kb())
 
 @router.message(FoundFlow.type, F.text.in_(ITEM_TYPES))
 async def found_type(message: Message, state: FSMContext):
     await state.update_data(item_type=message.text)
     await state.set_state(FoundFlow.description)
-    await message.answer("Опишите предмет (до 100 символов). Можно прикрепить фото.", reply_markup=skip_kb())
+    outbox.send(message.chat.id, "Опишите предмет (до 100 символов). Можно прикрепить фото.", reply_markup=skip_kb())
 
 @router.message(FoundFlow.description)
 async def found_desc(message: Message, state: FSMContext):
@@ -154,25 +185,25 @@ async def found_desc(message: Message, state: FSMContext):
     if text == "Пропустить":
         text = ""
     elif len(text) > 100:
-        await message.answer("Не более 100 символов. Повторите.")
+        outbox.send(message.chat.id, "Не более 100 символов. Повторите.")
         return
     photo_id = message.photo[-1].file_id if message.photo else None
     await state.update_data(description=text, photo_file_id=photo_id)
     await state.set_state(FoundFlow.location)
-    await message.answer("Где нашли?", reply_markup=location_kb(include_forget=False))
+    outbox.send(message.chat.id, "Где нашли?", reply_markup=location_kb(include_forget=False))
 
 @router.message(FoundFlow.location, F.text.in_(LOCATIONS))
 async def found_location(message: Message, state: FSMContext):
     await state.update_data(location=message.text)
     await state.set_state(FoundFlow.place_detail)
-    await message.answer("Уточните место (необязательно):", reply_markup=skip_kb())
+    outbox.send(message.chat.id, "Уточните место (необязательно):", reply_markup=skip_kb())
 
 @router.message(FoundFlow.place_detail)
 async def found_place(message: Message, state: FSMContext):
     detail = "" if message.text == "Пропустить" else message.text
     await state.update_data(place_detail=detail)
     await state.set_state(FoundFlow.contact_type)
-    await message.answer("Как передать находку?", reply_markup=contact_type_kb())
+    outbox.send(message.chat.id, "Как передать находку?", reply_markup=contact_type_kb())
 
 @router.callback_query(F.data.startswith("contact_type:"))
 async def found_contact_type(callback: CallbackQuery, state: FSMContext):
@@ -180,9 +211,9 @@ async def found_contact_type(callback: CallbackQuery, state: FSMContext):
     await state.update_data(contact_type=ct)
     await state.set_state(FoundFlow.contact_or_drop)
     if ct == "drop":
-        await callback.message.answer("Где оставили находку?")
+        outbox.send(callback.message.chat.id, "Где оставили находку?")
     else:
-        await callback.message.answer("Как с вами связаться?")
+        outbox.send(callback.message.chat.id, "Как с вами связаться?")
     await callback.answer()
 
 @router.message(FoundFlow.contact_or_drop)
@@ -193,7 +224,7 @@ async def found_finish(message: Message, state: FSMContext):
 
     # === ВЕКТОРИЗАЦИЯ ===
     text_for_embedding = f"{data['item_type']} {data['description']}"
-    embedding = encode_text(text_for_embedding)
+    embedding = await encode_text_async(text_for_embedding)
 
     ad_id = await create_ad(
         user_id=user_id,
@@ -207,35 +238,89 @@ async def found_finish(message: Message, state: FSMContext):
         contact_info=contact_info,
         embedding=embedding
     )
+    matcher.submit(ad_id, user_id, data["item_type"], data["location"], embedding)
 
-    await message.answer("✅ Объявление о находке опубликовано!", reply_markup=main_menu_kb())
+    outbox.send(message.chat.id, "✅ Объявление о находке опубликовано!", reply_markup=main_menu_kb())
     await state.clear()
 
 # --- ПОТЕРЯЛ ---
 @router.message(F.text == "❓ Потерял")
 async def lost_start(message: Message, state: FSMContext):
     await state.set_state(LostFlow.type)
-    await message.answer("Что потеряли?", reply_markup=item_type_kb())
+    outbox.send(message.chat.id, "Что потеряли?", reply_markup=item_type_kb())
 
 @router.message(LostFlow.type, F.text.in_(ITEM_TYPES))
 async def lost_type(message: Message, state: FSMContext):
     await state.update_data(item_type=message.text)
     await state.set_state(LostFlow.location)
-    await message.answer("Где потеряли?", reply_markup=location_kb(include_forget=True))
+    outbox.send(message.chat.id, "Где потеряли?", reply_markup=location_kb(include_forget=True))
 
 @router.message(LostFlow.location, F.text.in_(LOCATION_CHOICES))
 async def lost_location(message: Message, state: FSMContext):
     location = message.text if message.text != "Не помню" else None
     await state.update_data(location=location)
+    await state.set_state(LostFlow.query)
+    outbox.send(
+        message.chat.id,
+        "Опишите вещь своими словами (цвет, марка, приметы) или нажмите «Пропустить».",
+        reply_markup=skip_kb()
+    )
+
+@router.message(LostFlow.query, F.text)
+async def lost_query(message: Message, state: FSMContext):
+    free_text = "" if message.text == "Пропустить" else message.text.strip()[:200]
 
     # === ПОИСК ===
     data = await state.get_data()
     item_type = data["item_type"]
+    location = data["location"]
+    await state.clear()
 
-    ads = await get_active_ads_by_type_and_location(item_type, location)
-    if not ads:
-        await message.answer(
-            "🔍 Ничего не найдено.\nХотите подать объявление?",
+    # === ГИБРИДНЫЙ РЕЙТИНГ ===
+    await load_ad_index()
+    query_text = f"{item_type} {free_text}" if free_text else item_type
+    query_emb = await encode_query_async(query_text)
+    ranked = []
+    if free_text:
+        # FTS отбирает шорт-лист, косинус считается только по нему
+        text_hits = await search_fts(free_text, item_type, location, limit=FTS_SHORTLIST)
+        ranked = hybrid_rank(query_emb, text_hits, k=SEARCH_MAX_RESULTS, location_key=location)
+    else:
+        # Без текста выдача зависит только от (тип, корпус) — берём из кэша
+        await sync_result_cache()
+        ranked = result_cache.get_ranked(item_type, location)
+    if ranked is None:
+        ranked = search_nearby(query_emb, item_type, location, k=SEARCH_MAX_RESULTS)
+        result_cache.put_ranked(item_type, location, ranked)
+    elif free_text and len(ranked) < SEARCH_PAGE_SIZE:
+        # Слова не совпали — добираем чисто векторной выдачей
+        seen = {ad_id for ad_id, _ in ranked}
+        ranked += [
+            hit for hit in search_nearby(query_emb, item_type, location, k=SEARCH_MAX_RESULTS)
+            if hit[0] not in seen
+        ][:SEARCH_MAX_RESULTS - len(ranked)]
+
+    # Запоминаем поиск: о новых подходящих находках сообщим сами
+    request_id = await save_lost_request(
+        message.from_user.id, message.chat.id, item_type, location, query_emb,
+        seen_ad_ids=[ad_id for ad_id, _ in ranked]
+    )
+    matcher.add_request(request_id, message.from_user.id, item_type, location, query_emb)
+
+    # Первая страница: тексты из кэша выдач, остальное сверяется с БД по id
+    # (объявление могли архивировать из админки) — снятые выкидываем и добираем следующими
+    while True:
+        page = [ad_id for ad_id, _ in ranked[:SEARCH_PAGE_SIZE]]
+        rendered = await render_ads(page)
+        if len(rendered) == len(page):
+            break
+        ranked = [hit for hit in ranked if hit[0] in rendered or hit[0] not in page]
+    texts = list(rendered.values())
+    if not texts:
+        outbox.send(
+            message.chat.id,
+            "🔍 Ничего не найдено.\n🔔 Сообщим, если появится похожая находка.\n"
+            "Хотите подать объявление?",
             reply_markup=ReplyKeyboardMarkup(
                 keyboard=[
                     [KeyboardButton(text="➕ Подать объявление")],
@@ -246,18 +331,18 @@ async def lost_location(message: Message, state: FSMContext):
         )
         return
 
-    # === ВЕКТОРНЫЙ РЕЙТИНГ ===
-    query_text = item_type  # можно улучшить: добавить "потерял [item]"
-    query_emb = encode_text(query_text)
-    ads_with_emb = [(ad, blob_to_embedding(ad[10])) for ad in ads]
-    ranked = rank_ads_by_query(query_emb, ads_with_emb)
+    cursor = search_cursors.create(message.from_user.id, [ad_id for ad_id, _ in ranked])
+    await send_results_page(message, cursor, 0, texts)
 
-    # Показываем ТОП-5
-    for i, (ad, sim) in enumerate(ranked[:5], 1):
-        msg = format_ad_message(ad)
-        await message.answer(msg)
-
-    await message.answer("Нашли свою вещь? Свяжитесь с автором объявления.")
+@router.callback_query(F.data.startswith("more:"))
+async def lost_more(callback: CallbackQuery):
+    _, token, offset = callback.data.split(":")
+    cursor = search_cursors.get(callback.from_user.id, token)
+    if cursor is None:
+        await callback.answer("⌛ Результаты устарели, повторите поиск.", show_alert=True)
+        return
+    await send_results_page(callback.message, cursor, int(offset))
+    await callback.answer()
 
 # --- МОИ ОБЪЯВЛЕНИЯ ---
 @router.message(F.text == "📋 Мои объявления")
@@ -265,14 +350,11 @@ async def my_ads(message: Message):
     user_id = message.from_user.id
     ads = await get_user_ads(user_id, status="active")
     if not ads:
-        await message.answer("📭 У вас нет активных объявлений.", reply_markup=main_menu_kb())
+        outbox.send(message.chat.id, "📭 У вас нет активных объявлений.", reply_markup=main_menu_kb())
         return
 
     for ad in ads:
-        # Подготавливаем данные для format_ad_message (дополняем)
-        full_ad = (ad[0], user_id, *ad[1:9], None, ad[8], ad[9])  # подделываем под формат
-        msg = format_ad_message(full_ad, is_owner=True)
-        await message.answer(msg, reply_markup=archive_kb(ad[0]))
+        outbox.send(message.chat.id, format_ad_message(ad, is_owner=True), reply_markup=archive_kb(ad.id))
 
 # --- АРХИВАЦИЯ ---
 @router.callback_query(F.data.startswith("archive:"))
@@ -296,30 +378,66 @@ async def handle_archive(callback: CallbackQuery):
 # === ЗАПУСК ===
 dp.include_router(router)
 
-import os
-from aiogram import Bot, Dispatcher
+# === МЕТРИКИ ===
+router.message.middleware(HandlerTimingMiddleware())
+router.callback_query.middleware(HandlerTimingMiddleware())
+bot.session.middleware(TelegramTimingMiddleware())
+registry.gauge("bot_encoder_queue_depth", "Запросы в очереди кодировщика", lambda: encoder.queue_depth)
+registry.counter("bot_query_cache_hits_total", "Попадания в кэш эмбеддингов запросов", lambda: query_cache.hits)
+registry.counter("bot_query_cache_misses_total", "Промахи кэша эмбеддингов запросов", lambda: query_cache.misses)
+registry.gauge("bot_query_cache_hit_ratio", "Доля попаданий в кэш запросов", lambda: query_cache.stats()["hit_ratio"])
+registry.gauge("bot_outbox_queue_depth", "Сообщения в очереди на отправку", lambda: outbox.queue_depth)
+registry.counter("bot_result_cache_hits_total", "Поиски, отданные из кэша выдач", lambda: result_cache.hits)
+registry.counter("bot_result_cache_misses_total", "Поиски без кэша выдач", lambda: result_cache.misses)
+registry.counter("bot_result_cache_message_hits_total", "Тексты объявлений из кэша", lambda: result_cache.message_hits)
+registry.gauge("bot_ad_index_size", "Объявлений в векторном индексе", lambda: len(ad_index))
+registry.gauge("bot_updates_in_flight", "Принятые, но ещё не обработанные апдейты", lambda: updates.in_flight)
+registry.counter("bot_updates_duplicates_total", "Отброшенные повторы update_id", lambda: updates.duplicates)
+registry.gauge("bot_match_queue_depth", "Находки в очереди на сопоставление", lambda: matcher.queue_depth)
+registry.gauge("bot_lost_requests", "Сохранённых поисков в индексе", lambda: len(matcher.requests))
+
+# Соединения с БД живут всё время работы бота
+async def on_startup():
+    await open_db()
+    await init_db()
+    await load_ad_index()
+    await matcher.start()
+    maintenance.start()
+    if os.getenv("RENDER") is not None:
+        await bot.set_webhook(WEBHOOK_URL)
+    dp["loop_lag_task"] = asyncio.create_task(monitor_loop_lag())
+    # Модель грузится в фоне: бот уже принимает апдейты
+    if os.getenv("ENCODER_WARMUP", "1") == "1":
+        dp["warmup_task"] = asyncio.create_task(warm_up(ITEM_TYPES))
+
+async def on_shutdown():
+    dp["loop_lag_task"].cancel()
+    await updates.close()
+    await matcher.stop()
+    await maintenance.stop()
+    await outbox.close()
+    await dp.storage.close()
+    await encoder.close()
+    await close_db()
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
 from aiogram.webhook.aiohttp_server import (
     SimpleRequestHandler,
     setup_application,
 )
 from aiohttp import web
-from dotenv import load_dotenv
 
-load_dotenv()
-
-# Получаем токен и настройки
-BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Настройки вебхука
 WEBHOOK_HOST = os.getenv("RENDER_EXTERNAL_URL", "https://your-bot.onrender.com")
 WEBHOOK_PATH = f"/webhook/{BOT_TOKEN}"
 WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
 
-# Создаём приложение
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
-dp.include_router(router)
-
 app = web.Application()
-SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
+# Без фоновых задач aiogram: ответ вебхуку ждёт только места в UpdateScheduler,
+# так что при перегрузке Telegram притормаживает сам
+SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=False).register(app, path=WEBHOOK_PATH)
 setup_application(app, dp, bot=bot)
 
 # Health-check эндпоинт (обязательно для Render!)
@@ -327,12 +445,12 @@ async def ping(request):
     return web.Response(text="OK")
 
 app.router.add_get("/ping", ping)
+app.router.add_get("/metrics", metrics_handler)
 
 if __name__ == "__main__":
     # Локально можно использовать polling (для тестов)
     if os.getenv("RENDER") is None:
-        import asyncio
-        asyncio.run(dp.start_polling(bot))
+        asyncio.run(dp.start_polling(bot, handle_as_tasks=False))
     else:
         # На Render — запускаем веб-сервер
         port = int(os.getenv("PORT", 10000))
@@ -0,0 +1,192 @@
+"""
+Плановое обслуживание БД внутри процесса бота.
+
+Каждые MAINTENANCE_INTERVAL секунд:
+  * активные объявления старше AD_MAX_AGE_DAYS архивируются;
+  * архивные строки пачками переезжают из ads в ads_archive (без эмбеддингов),
+    так что поиск работает только с маленькой горячей таблицей;
+  * истёкшие сохранённые поиски удаляются.
+Раз в сутки, в час MAINTENANCE_HOUR (по времени сервера), — ANALYZE,
+incremental vacuum и WAL checkpoint (TRUNCATE).
+
+Разовый проход: python maintenance.py
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+from database import Database, bump_generations, db as default_db
+from queries import (
+    ARCHIVED_AD_IDS, EXPIRE_ADS, PURGE_LOST_REQUESTS, PURGE_MATCH_NOTIFICATIONS, move_to_archive
+)
+from result_cache import result_cache
+from vector_index import ad_index
+
+AD_MAX_AGE_DAYS = int(os.getenv("AD_MAX_AGE_DAYS", 30))
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", 3600))
+MAINTENANCE_HOUR = int(os.getenv("MAINTENANCE_HOUR", 4))
+MAINTENANCE_BATCH = 500
+VACUUM_PAGES = 2000  # страниц за один incremental_vacuum
+
+
+async def expire_old_ads(database: Database = default_db, max_age_days: int = AD_MAX_AGE_DAYS,
+                         batch_size: int = MAINTENANCE_BATCH) -> int:
+    """Архивирует активные объявления старше max_age_days. Возвращает их число."""
+    total = 0
+    while True:
+        async with database.write() as conn:
+            cursor = await conn.execute(EXPIRE_ADS, (f"-{max_age_days} days", batch_size))
+            rows = await cursor.fetchall()
+            bumped = await bump_generations(conn, [(item_type, location_key) for _, item_type, location_key in rows])
+        for ad_id, _, _ in rows:
+            ad_index.remove(ad_id)
+        for partition in bumped:
+            result_cache.bump(*partition)
+        total += len(rows)
+        if len(rows) < batch_size:
+            return total
+        await asyncio.sleep(0)  # пропускаем записи обработчиков между пачками
+
+
+async def move_archived_ads(database: Database = default_db, batch_size: int = MAINTENANCE_BATCH) -> int:
+    """Переносит архивные строки в ads_archive пачками, каждая — своя транзакция."""
+    total = 0
+    while True:
+        async with database.write() as conn:
+            cursor = await conn.execute(ARCHIVED_AD_IDS, (batch_size,))
+            ids = tuple(row[0] for row in await cursor.fetchall())
+            if ids:
+                copy, delete = move_to_archive(len(ids))
+                await conn.execute(copy, ids)
+                await conn.execute(delete, ids)
+        total += len(ids)
+        if len(ids) < batch_size:
+            return total
+        await asyncio.sleep(0)
+
+
+async def purge_expired_lost_requests(database: Database = default_db) -> List[int]:
+    """Удаляет истёкшие поиски вместе с их отметками уведомлений. Возвращает их id."""
+    async with database.write() as conn:
+        cursor = await conn.execute(PURGE_LOST_REQUESTS)
+        ids = [row[0] for row in await cursor.fetchall()]
+        if ids:
+            await conn.executemany(PURGE_MATCH_NOTIFICATIONS, [(i,) for i in ids])
+    return ids
+
+
+async def ensure_incremental_vacuum(database: Database = default_db):
+    """
+    Включает auto_vacuum = INCREMENTAL. На существующем файле режим вступает
+    в силу только после полного VACUUM — он выполняется один раз.
+    """
+    async with database.read() as conn:
+        cursor = await conn.execute("PRAGMA auto_vacuum")
+        mode = (await cursor.fetchone())[0]
+    if mode == 2:
+        return
+    logging.info("🧹 Перевод БД на incremental vacuum (однократный VACUUM)…")
+    async with database.write() as conn:
+        await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await conn.execute("VACUUM")
+
+
+async def optimize_storage(database: Database = default_db):
+    """ANALYZE, возврат свободных страниц и усечение WAL."""
+    await ensure_incremental_vacuum(database)
+    async with database.write() as conn:
+        await conn.execute("ANALYZE")
+    async with database.write() as conn:
+        await conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+    async with database.write() as conn:
+        await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+async def run_maintenance(database: Database = default_db, full: bool = False) -> List[int]:
+    """Один проход обслуживания. Возвращает id удалённых поисков."""
+    started = time.perf_counter()
+    expired = await expire_old_ads(database)
+    moved = await move_archived_ads(database)
+    purged = await purge_expired_lost_requests(database)
+    if full:
+        await optimize_storage(database)
+    else:
+        async with database.write() as conn:
+            await conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    logging.info(
+        f"🧹 Обслуживание БД: архивировано {expired}, перенесено {moved}, "
+        f"удалено поисков {len(purged)}{', ANALYZE/VACUUM' if full else ''} "
+        f"за {time.perf_counter() - started:.2f} с"
+    )
+    return purged
+
+
+class MaintenanceScheduler:
+    def __init__(
+        self,
+        database: Database = default_db,
+        interval: float = MAINTENANCE_INTERVAL,
+        hour: int = MAINTENANCE_HOUR,
+        on_requests_purged: Optional[Callable[[List[int]], None]] = None
+    ):
+        self.db = database
+        self.interval = interval
+        self.hour = hour
+        self.on_requests_purged = on_requests_purged
+        self._last_full: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _full_due(self) -> bool:
+        now = datetime.now()
+        return now.hour == self.hour and (self._last_full is None or self._last_full.date() != now.date())
+
+    def _next_delay(self) -> float:
+        """Интервал, но не дольше, чем до начала часа обслуживания."""
+        now = datetime.now()
+        at = now.replace(hour=self.hour, minute=0, second=0, microsecond=0)
+        if at <= now:
+            at += timedelta(days=1)
+        return min(self.interval, (at - now).total_seconds())
+
+    async def _run(self):
+        while True:
+            full = self._full_due()
+            try:
+                purged = await run_maintenance(self.db, full=full)
+                if full:
+                    self._last_full = datetime.now()
+                if purged and self.on_requests_purged is not None:
+                    self.on_requests_purged(purged)
+            except Exception as e:
+                logging.error(f"Ошибка обслуживания БД: {e}")
+            await asyncio.sleep(self._next_delay())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    async def _main():
+        from database import close_db, init_db
+        try:
+            await init_db()
+            await run_maintenance(full=True)
+        finally:
+            await close_db()
+
+    asyncio.run(_main())
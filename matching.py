@@ -0,0 +1,137 @@
+"""
+Обратное сопоставление: новые объявления «нашёл» против сохранённых поисков.
+
+Каждый поиск в LostFlow сохраняется в lost_requests. Новые объявления
+ставятся в очередь, фоновый воркер забирает их пачкой и для каждой пары
+(тип, корпус) считает близость ко всем подходящим поискам (корпуса того же
+здания и «Не помню») одним умножением матриц. Пользователи с близостью
+выше MATCH_THRESHOLD получают уведомление; пара (поиск, объявление) уведомляется не больше одного раза.
+"""
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from database import (
+    IncompatibleEmbedding, blob_to_embedding, claim_match_notifications,
+    get_ads_by_ids, iter_active_lost_requests
+)
+from locations import co_located
+from vector_index import AdIndex, normalize
+
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", 0.45))
+MATCH_BATCH = 64
+ANY_LOCATION = ""  # поиск с «Не помню»
+
+
+class _NewAd:
+    __slots__ = ("ad_id", "user_id", "item_type", "location_key", "vec")
+
+    def __init__(self, ad_id: int, user_id: int, item_type: str, location_key: str, vec: np.ndarray):
+        self.ad_id = ad_id
+        self.user_id = user_id
+        self.item_type = item_type
+        self.location_key = location_key
+        self.vec = vec
+
+
+class MatchWorker:
+    def __init__(
+        self,
+        notify: Callable[[int, Tuple], None],
+        threshold: float = MATCH_THRESHOLD
+    ):
+        """notify(chat_id, ad_row) отправляет уведомление (без ожидания доставки)."""
+        self.notify = notify
+        self.threshold = threshold
+        self.requests = AdIndex()           # id поиска → вектор, партиции (тип, корпус)
+        self._owners: Dict[int, int] = {}   # id поиска → user_id
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        skipped = 0
+        async for rows in iter_active_lost_requests():
+            for request_id, user_id, item_type, location_key, blob in rows:
+                try:
+                    self.add_request(request_id, user_id, item_type, location_key, blob_to_embedding(blob))
+                except IncompatibleEmbedding:
+                    skipped += 1
+        if skipped:
+            logging.warning(f"⚠️ Пропущено поисков с эмбеддингом другой модели: {skipped}")
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def add_request(self, request_id: int, user_id: int, item_type: str,
+                    location_key: Optional[str], embedding: np.ndarray):
+        self.requests.add(request_id, item_type, location_key or ANY_LOCATION, embedding)
+        self._owners[request_id] = user_id
+
+    def remove_requests(self, request_ids: List[int]):
+        for request_id in request_ids:
+            self.requests.remove(request_id)
+            self._owners.pop(request_id, None)
+
+    def submit(self, ad_id: int, user_id: int, item_type: str, location_key: str, embedding: np.ndarray):
+        """Ставит новое объявление «нашёл» в очередь на сопоставление."""
+        if self._queue is not None:
+            self._queue.put_nowait(_NewAd(ad_id, user_id, item_type, location_key, normalize(embedding)))
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < MATCH_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._process(batch)
+            except Exception as e:
+                logging.error(f"Ошибка сопоставления: {e}")
+
+    def score(self, batch: List[_NewAd]) -> List[Tuple[int, int]]:
+        """Пары (id поиска, id объявления) с близостью не ниже порога."""
+        groups: Dict[Tuple[str, str], List[_NewAd]] = defaultdict(list)
+        for ad in batch:
+            groups[(ad.item_type, ad.location_key)].append(ad)
+
+        pairs = []
+        for (item_type, location_key), ads in groups.items():
+            # Поиски по любому корпусу того же здания и «Не помню»
+            keys = [(item_type, loc) for loc in co_located(location_key)] + [(item_type, ANY_LOCATION)]
+            ids, matrix = self.requests.partition_matrix(keys)
+            if not len(ids):
+                continue
+            # (поиски × объявления) за одно умножение
+            scores = matrix @ np.stack([ad.vec for ad in ads]).T
+            rows, cols = np.nonzero(scores >= self.threshold)
+            for r, c in zip(rows, cols):
+                request_id, ad = int(ids[r]), ads[c]
+                if self._owners.get(request_id) != ad.user_id:
+                    pairs.append((request_id, ad.ad_id))
+        return pairs
+
+    async def _process(self, batch: List[_NewAd]):
+        pairs = self.score(batch)
+        claimed = await claim_match_notifications(pairs)
+        if not claimed:
+            return
+        ads = {ad.id: ad for ad in await get_ads_by_ids(list({ad_id for _, ad_id, _ in claimed}))}
+        for _, ad_id, chat_id in claimed:
+            ad = ads.get(ad_id)
+            if ad is not None:
+                self.notify(chat_id, ad)
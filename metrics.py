@@ -0,0 +1,195 @@
+"""
+Метрики в формате Prometheus без внешних зависимостей.
+
+Гистограммы и счётчики живут в памяти процесса, /metrics отдаёт их
+текстом. Запись в гистограмму — это bisect по границам бакетов и пара
+сложений, поэтому таймеры можно вешать на горячий путь.
+"""
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in self._values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, values)} {total}")
+        return "\n".join(lines)
+
+
+class Gauge:
+    """Значение вычисляется при каждом скрейпе функцией fn."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name, self.help, self.fn = name, help, fn
+
+    def render(self) -> str:
+        return f"# HELP {self.name} {self.help}\n# TYPE {self.name} gauge\n{self.name} {float(self.fn())}"
+
+
+class CallbackCounter(Gauge):
+    """Счётчик, который ведёт сам объект (hits, misses...): значение берётся из fn при скрейпе."""
+
+    def render(self) -> str:
+        return f"# HELP {self.name} {self.help}\n# TYPE {self.name} counter\n{self.name} {float(self.fn())}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelValues, list] = {}  # метки → [счётчики бакетов..., +Inf, сумма]
+
+    def observe(self, value: float, *labels: str):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {cumulative}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, help, fn))
+
+    def counter(self, name: str, help: str, fn: Callable[[], float]) -> CallbackCounter:
+        return self.register(CallbackCounter(name, help, fn))
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.register(Histogram(
+    "bot_handler_seconds", "Время обработчика aiogram", ("handler", "state")))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler",)))
+db_seconds = registry.register(Histogram(
+    "bot_db_seconds", "Время функций database.py", ("query",)))
+inference_seconds = registry.register(Histogram(
+    "bot_inference_seconds", "Время кодирования и ранжирования", ("op",)))
+telegram_seconds = registry.register(Histogram(
+    "bot_telegram_request_seconds", "Время запросов к Bot API", ("method",)))
+loop_lag_seconds = registry.register(Histogram(
+    "bot_event_loop_lag_seconds", "Задержка event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+
+
+def timed(histogram: Histogram, label: Optional[str] = None):
+    """Декоратор: время вызова функции (sync или async) в histogram."""
+    def decorator(fn):
+        name = label or fn.__name__
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, name)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Внутренний middleware: время каждого обработчика по имени и FSM-состоянию."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        state = data.get("raw_state") or "none"
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, name, state)
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого вызова Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            telegram_seconds.observe(time.perf_counter() - start, type(method).__name__)
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    """Фоновая задача: насколько позже запланированного просыпается event loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(0.0, loop.time() - start - interval))
+
+
+async def metrics_handler(request):
+    from aiohttp import web
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
@@ -0,0 +1,57 @@
+"""
+Записи объявлений и проекции колонок под каждый сценарий.
+
+Ad — компактная запись со __slots__ вместо позиционного кортежа. Запросы
+выбирают только нужные колонки:
+
+    DISPLAY_COLUMNS — выдача поиска и уведомления (без автора, фото и BLOB);
+    OWNER_COLUMNS   — «Мои объявления», всё кроме эмбеддинга.
+
+Эмбеддинги читает только load_ad_index, дальше поиск идёт по ad_index.
+
+Порядок DISPLAY_COLUMNS совпадает с позиционными аргументами Ad, поэтому
+строка курсора превращается в запись одним Ad(*row), без словарей.
+"""
+from typing import Optional
+
+DISPLAY_COLUMNS = (
+    "id", "ad_type", "item_type", "description", "location_key", "place_detail",
+    "contact_type", "contact_info", "status", "created_at"
+)
+OWNER_COLUMNS = DISPLAY_COLUMNS + ("user_id", "photo_file_id")
+
+
+class Ad:
+    __slots__ = OWNER_COLUMNS
+
+    def __init__(
+        self,
+        id: int,
+        ad_type: str,
+        item_type: str,
+        description: Optional[str],
+        location_key: str,
+        place_detail: Optional[str],
+        contact_type: Optional[str],
+        contact_info: Optional[str],
+        status: str,
+        created_at: str,
+        user_id: Optional[int] = None,
+        photo_file_id: Optional[str] = None
+    ):
+        self.id = id
+        self.ad_type = ad_type
+        self.item_type = item_type
+        self.description = description
+        self.location_key = location_key
+        self.place_detail = place_detail
+        self.contact_type = contact_type
+        self.contact_info = contact_info
+        self.status = status
+        self.created_at = created_at
+        self.user_id = user_id
+        self.photo_file_id = photo_file_id
+
+    def __repr__(self) -> str:
+        return f"Ad(id={self.id}, {self.ad_type} {self.item_type!r} @ {self.location_key!r}, {self.status})"
+
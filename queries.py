@@ -0,0 +1,122 @@
+"""
+SQL админки и планового обслуживания.
+
+admin.py при импорте поднимает интерфейс Streamlit, поэтому его запросы
+собираются здесь — тем же кодом пользуются и админка, и проверка планов
+(database.check_query_plans): проверяется ровно тот SQL, что выполняется.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Tuple
+
+# === Обслуживание (maintenance.py) ===
+ARCHIVE_COLUMNS = (
+    "id, user_id, ad_type, item_type, description, photo_file_id, "
+    "location_key, place_detail, contact_type, contact_info, created_at"
+)
+
+EXPIRE_ADS = """
+    UPDATE ads SET status = 'archived'
+    WHERE id IN (
+        SELECT id FROM ads
+        WHERE status = 'active' AND created_at < datetime('now', ?)
+        LIMIT ?
+    )
+    RETURNING id, item_type, location_key
+"""
+
+ARCHIVED_AD_IDS = "SELECT id FROM ads WHERE status = 'archived' ORDER BY id LIMIT ?"
+
+PURGE_LOST_REQUESTS = "DELETE FROM lost_requests WHERE expires_at <= datetime('now') RETURNING id"
+
+PURGE_MATCH_NOTIFICATIONS = "DELETE FROM match_notifications WHERE request_id = ?"
+
+
+def move_to_archive(count: int) -> Tuple[str, str]:
+    """Перенос count архивных строк из ads в ads_archive: (INSERT, DELETE) по списку id."""
+    placeholders = ",".join("?" * count)
+    return (
+        f"INSERT OR REPLACE INTO ads_archive ({ARCHIVE_COLUMNS}) "
+        f"SELECT {ARCHIVE_COLUMNS} FROM ads WHERE id IN ({placeholders})",
+        f"DELETE FROM ads WHERE id IN ({placeholders})",
+    )
+
+
+# === Админка (admin.py) ===
+# Поколения разделов для кэша выдач бота. Админка создаёт таблицу и сама:
+# её база может быть старше бота, который делает это в init_db
+CREATE_AD_GENERATIONS = """
+    CREATE TABLE IF NOT EXISTS ad_generations (
+        item_type TEXT NOT NULL,
+        location_key TEXT NOT NULL,
+        generation INTEGER NOT NULL,
+        PRIMARY KEY(item_type, location_key)
+    ) WITHOUT ROWID
+"""
+
+# Горячая таблица и холодный архив (maintenance.py переносит туда архивные строки)
+HISTORY_TABLES = (
+    "ads",
+    """(SELECT id, ad_type, item_type, description, location_key,
+               contact_type, contact_info, 'archived' AS status, created_at
+        FROM ads_archive)""",
+)
+PAGE_COLUMNS = "id, ad_type, item_type, description, location_key, contact_type, contact_info, status, created_at"
+
+
+def history_tables(status: str) -> Tuple[str, ...]:
+    """Где искать: в архиве только архивные, для активных он не нужен."""
+    return HISTORY_TABLES[:1] if status == "active" else HISTORY_TABLES
+
+
+def build_filters(status: str, ad_type: str, item: str, location: str,
+                  date_from: Optional[date], date_to: Optional[date]) -> Tuple[str, tuple]:
+    clauses, params = [], []
+    if status != "Все":
+        clauses.append("status = ?")
+        params.append(status)
+    if ad_type != "Все":
+        clauses.append("ad_type = ?")
+        params.append(ad_type)
+    if item != "Все":
+        clauses.append("item_type = ?")
+        params.append(item)
+    if location != "Все":
+        clauses.append("location_key = ?")
+        params.append(location)
+    if date_from:
+        clauses.append("created_at >= ?")
+        params.append(datetime.combine(date_from, time.min).isoformat(sep=" "))
+    if date_to:
+        clauses.append("created_at < ?")
+        params.append(datetime.combine(date_to + timedelta(days=1), time.min).isoformat(sep=" "))
+    where = " AND ".join(clauses) or "1"
+    return where, tuple(params)
+
+
+def count_query(tables: Tuple[str, ...], where: str, params: tuple) -> Tuple[str, tuple]:
+    # По таблице отдельно: фильтр попадает в каждую и считается по её индексам
+    arms = " UNION ALL ".join(f"SELECT COUNT(*) AS n FROM {table} WHERE {where}" for table in tables)
+    return f"SELECT SUM(n) FROM ({arms})", params * len(tables)
+
+
+def page_query(tables: Tuple[str, ...], where: str, params: tuple,
+               after: Optional[Tuple[str, int]], limit: int) -> Tuple[str, tuple]:
+    """Страница по ключу (created_at, id): без OFFSET, по индексу на created_at."""
+    if after is not None:
+        where = f"({where}) AND (created_at, id) < (?, ?)"
+        params = params + tuple(after)
+    # Каждая таблица отдаёт свою страницу по индексу, затем слияние —
+    # иначе SQLite сортирует весь ads_history целиком
+    arms = " UNION ALL ".join(f"""
+        SELECT * FROM (
+            SELECT {PAGE_COLUMNS}
+            FROM {table}
+            WHERE {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT {limit}
+        )""" for table in tables)
+    return f"""
+        {arms}
+        ORDER BY created_at DESC, id DESC
+        LIMIT {limit}
+    """, params * len(tables)
@@ -0,0 +1,165 @@
+"""
+Кэш горячих выдач поиска.
+
+Между парами одни и те же (тип вещи, корпус) ищут постоянно. Здесь лежат
+ранжированные списки id для поиска без текста и готовые тексты объявлений,
+так что повторный поиск не трогает ни индекс, ни БД, ни format_ad_message.
+
+Свежесть — через счётчики поколений по разделам (item_type, location_key):
+каждая запись в ads (create_ad, archive_ad, автоархивация, админка, импорт)
+в той же транзакции увеличивает счётчик раздела в таблице ad_generations, и
+всё посчитанное при старом поколении перестаёт совпадать. Свои записи
+процесс учитывает сразу, чужие — при сверке с ad_generations не чаще раза в
+RESULT_CACHE_SYNC_INTERVAL секунд (database.sync_result_cache, она же
+перечитывает такие разделы в ad_index). Оба кэша — LRU с ограничением по
+числу записей.
+"""
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from formatting import format_ad_message
+from locations import nearby
+from models import Ad
+
+RESULT_CACHE_SEARCHES = int(os.getenv("RESULT_CACHE_SEARCHES", 512))
+RESULT_CACHE_MESSAGES = int(os.getenv("RESULT_CACHE_MESSAGES", 5000))
+RESULT_CACHE_SYNC_INTERVAL = float(os.getenv("RESULT_CACHE_SYNC_INTERVAL", 5))
+
+Partition = Tuple[str, str]
+Ranked = List[Tuple[int, float]]
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_searches: int = RESULT_CACHE_SEARCHES,
+        max_messages: int = RESULT_CACHE_MESSAGES,
+        sync_interval: float = RESULT_CACHE_SYNC_INTERVAL
+    ):
+        self.max_searches = max_searches
+        self.max_messages = max_messages
+        self.sync_interval = sync_interval
+        self.hits = 0
+        self.misses = 0
+        self.message_hits = 0
+        self.message_misses = 0
+        self._generations: Dict[Partition, int] = {}
+        self._external: Dict[Partition, int] = {}  # последние значения из ad_generations
+        self._version = 0  # растёт при любом bump
+        self._synced = 0.0
+        self._searches: OrderedDict = OrderedDict()  # (item_type, location_key) → (отпечаток, ranked)
+        self._messages: OrderedDict = OrderedDict()  # ad_id → (раздел, поколение, текст)
+
+    def bump(self, item_type: str, location_key: str, generation: Optional[int] = None):
+        """
+        Раздел изменился: всё, что из него посчитано, устарело. generation —
+        новое значение в ad_generations после своей записи: если до неё мы
+        были в курсе всех чужих изменений, раздел при сверке не перечитывается.
+        """
+        key = (item_type, location_key)
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._version += 1
+        if generation is not None and self._external.get(key, 0) == generation - 1:
+            self._external[key] = generation
+
+    def clear(self):
+        self._searches.clear()
+        self._messages.clear()
+
+    @property
+    def sync_due(self) -> bool:
+        return time.monotonic() - self._synced >= self.sync_interval
+
+    def reset_external(self, rows: Iterable[Tuple[str, str, int]]):
+        """Строки ad_generations на момент загрузки ad_index — от них считаются чужие изменения."""
+        self._external = {(item_type, location_key): generation for item_type, location_key, generation in rows}
+        self._synced = time.monotonic()
+
+    def apply_external(self, rows: Iterable[Tuple[str, str, int]]) -> List[Partition]:
+        """
+        Строки ad_generations: изменившиеся с прошлой сверки разделы сбрасываются.
+        Возвращает их — ad_index по ним тоже устарел.
+        """
+        self._synced = time.monotonic()
+        changed = []
+        for item_type, location_key, generation in rows:
+            key = (item_type, location_key)
+            if self._external.get(key, 0) != generation:
+                self._external[key] = generation
+                self.bump(item_type, location_key)
+                changed.append(key)
+        return changed
+
+    def stale(self, item_type: str, location_key: str):
+        """Раздел не удалось перечитать — повторим при следующей сверке."""
+        self._external.pop((item_type, location_key), None)
+
+    def generation(self, item_type: str, location_key: str) -> int:
+        return self._generations.get((item_type, location_key), 0)
+
+    def forget(self, ad_ids: Iterable[int]):
+        """Объявления завершены в другом процессе: убираем их из выдач и текстов."""
+        gone = set(ad_ids)
+        for ad_id in gone:
+            self._messages.pop(ad_id, None)
+        for cache_key, (fingerprint, ranked) in self._searches.items():
+            if any(ad_id in gone for ad_id, _ in ranked):
+                self._searches[cache_key] = (fingerprint, [hit for hit in ranked if hit[0] not in gone])
+
+    def _fingerprint(self, item_type: str, location_key: Optional[str]) -> Tuple[int, ...]:
+        # Выдача по корпусу собирается и из соседних корпусов
+        return tuple(self._generations.get((item_type, key), 0) for key in nearby(location_key))
+
+    # --- ранжированные выдачи ---
+    def get_ranked(self, item_type: str, location_key: Optional[str]) -> Optional[Ranked]:
+        cache_key = (item_type, location_key)
+        entry = self._searches.get(cache_key)
+        if entry is not None and entry[0] == self._fingerprint(item_type, location_key):
+            self._searches.move_to_end(cache_key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put_ranked(self, item_type: str, location_key: Optional[str], ranked: Ranked):
+        cache_key = (item_type, location_key)
+        self._searches[cache_key] = (self._fingerprint(item_type, location_key), ranked)
+        self._searches.move_to_end(cache_key)
+        while len(self._searches) > self.max_searches:
+            self._searches.popitem(last=False)
+
+    # --- тексты объявлений ---
+    async def render(self, ad_ids: List[int], fetch: Callable[[List[int]], Awaitable[List[Ad]]]) -> Dict[int, str]:
+        """
+        {ad_id: текст} активных объявлений в порядке ad_ids; чего нет в кэше —
+        читается через fetch (get_ads_by_ids). Завершённые пропускаются.
+        """
+        texts: Dict[int, str] = {}
+        missing = []
+        for ad_id in ad_ids:
+            entry = self._messages.get(ad_id)
+            if entry is not None and self._generations.get(entry[0], 0) == entry[1]:
+                self._messages.move_to_end(ad_id)
+                texts[ad_id] = entry[2]
+            else:
+                missing.append(ad_id)
+        self.message_hits += len(ad_ids) - len(missing)
+        self.message_misses += len(missing)
+        if missing:
+            version = self._version
+            ads = await fetch(missing)
+            # Пока читали, объявление могли архивировать — такое не запоминаем
+            cacheable = self._version == version
+            for ad in ads:
+                text = texts[ad.id] = format_ad_message(ad)
+                if cacheable:
+                    key = (ad.item_type, ad.location_key)
+                    self._messages[ad.id] = (key, self._generations.get(key, 0), text)
+            while len(self._messages) > self.max_messages:
+                self._messages.popitem(last=False)
+        return {ad_id: texts[ad_id] for ad_id in ad_ids if ad_id in texts}
+
+
+result_cache = ResultCache()
@@ -1,26 +1,340 @@
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional, Tuple
+import asyncio
+import os
+import secrets
+import time
 import numpy as np
 import logging
 
-# Загружаем модель один раз при импорте
-logging.info("🔍 Загружаем модель для векторного поиска...")
-model = SentenceTransformer('all-MiniLM-L6-v2', device='cpu')
-logging.info("✅ Модель загружена.")
+from encoders import get_backend
+from metrics import inference_seconds, timed
+from locations import location_bias
+from vector_index import ad_index, top_k
 
+# Модель загружается лениво (см. encoders.py) — при первом кодировании
+# или фоновым прогревом после старта бота.
+ENCODER_MAX_BATCH = int(os.getenv("ENCODER_MAX_BATCH", 32))
+ENCODER_MAX_WAIT_MS = float(os.getenv("ENCODER_MAX_WAIT_MS", 10))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 3600))
+# Шаблоны поисковых запросов, которые прогреваются для каждого типа вещи
+QUERY_TEMPLATES = ("{}",)
+SEARCH_CURSOR_TTL = float(os.getenv("SEARCH_CURSOR_TTL", 900))
+SEARCH_CURSOR_MAX = 10000
+# Вес BM25 в гибридной оценке (остальное — косинус)
+HYBRID_TEXT_WEIGHT = float(os.getenv("HYBRID_TEXT_WEIGHT", 0.3))
+
+@timed(inference_seconds)
 def encode_text(text: str) -> np.ndarray:
     """Преобразует текст в вектор (эмбеддинг) размерности 384."""
-    return model.encode(text, convert_to_numpy=True)
+    return get_backend().encode([text])[0]
+
+@timed(inference_seconds)
+def encode_batch(texts: List[str]) -> np.ndarray:
+    """Кодирует список текстов одним проходом модели."""
+    return get_backend().encode(texts)
+
+
+class BatchEncoder:
+    """
+    Асинхронный кодировщик с микробатчингом.
+
+    Запросы, пришедшие одновременно, копятся до max_batch_size штук или
+    max_wait_ms миллисекунд и кодируются одним вызовом в отдельном потоке,
+    поэтому event loop бота не блокируется на инференсе.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = ENCODER_MAX_BATCH,
+        max_wait_ms: float = ENCODER_MAX_WAIT_MS,
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._pending: list = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def _ensure_worker(self):
+        if self._executor is None:
+            # Один поток: torch сам распараллеливает батч и отпускает GIL
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder")
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def encode(self, text: str) -> np.ndarray:
+        self._ensure_worker()
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((text, fut))
+        self._wakeup.set()
+        return await fut
+
+    async def _collect(self):
+        """Ждёт соседние запросы, пока батч не заполнится или не выйдет время."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(self._pending) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._pending:
+                continue
+            if self.max_wait > 0:
+                await self._collect()
+
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            if self._pending:
+                self._wakeup.set()
+            batch = [(text, fut) for text, fut in batch if not fut.cancelled()]
+            if not batch:
+                continue
+
+            texts = [text for text, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(self._executor, self.encode_fn, texts)
+            except Exception as e:
+                logging.error(f"Ошибка кодирования батча: {e}")
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), vec in zip(batch, vectors):
+                if not fut.done():
+                    fut.set_result(vec)
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for _, fut in self._pending:
+            if not fut.done():
+                fut.cancel()
+        self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+encoder = BatchEncoder(encode_batch)
+
+async def encode_text_async(text: str) -> np.ndarray:
+    """Как encode_text, но не блокирует event loop и батчит одновременные запросы."""
+    return await encoder.encode(text)
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов запросов.
+
+    Прогретые векторы (типы вещей) закреплены навсегда, остальные живут в
+    LRU с ограничением по размеру и TTL. Ключ — (модель, нормализованный текст).
+    """
+
+    def __init__(self, model_id: str, max_size: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.model_id = model_id
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._pinned: dict = {}
+        self._lru: OrderedDict = OrderedDict()  # ключ → (истекает, вектор)
+
+    def _key(self, text: str) -> Tuple[str, str]:
+        return (self.model_id, normalize_query(text))
 
-def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
-    return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
+    def __len__(self) -> int:
+        return len(self._pinned) + len(self._lru)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self._key(text)
+        vec = self._pinned.get(key)
+        if vec is None:
+            entry = self._lru.get(key)
+            if entry is not None:
+                expires, vec = entry
+                if expires < time.monotonic():
+                    del self._lru[key]
+                    vec = None
+                else:
+                    self._lru.move_to_end(key)
+        if vec is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return vec
+
+    def put(self, text: str, vec: np.ndarray, pinned: bool = False):
+        vec = np.asarray(vec, dtype=np.float32)
+        vec.setflags(write=False)
+        key = self._key(text)
+        if pinned:
+            self._lru.pop(key, None)
+            self._pinned[key] = vec
+            return
+        if key in self._pinned or self.max_size <= 0:
+            return
+        self._lru[key] = (time.monotonic() + self.ttl, vec)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def clear(self):
+        self._pinned.clear()
+        self._lru.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "pinned": len(self._pinned),
+            "size": len(self._lru),
+        }
+
+
+query_cache = EmbeddingCache(get_backend().model_id)
+
+@timed(inference_seconds, "encode_query")
+async def encode_query_async(text: str) -> np.ndarray:
+    """Эмбеддинг поискового запроса: сначала из кэша, иначе через encoder."""
+    vec = query_cache.get(text)
+    if vec is None:
+        vec = await encoder.encode(text)
+        query_cache.put(text, vec)
+    return vec
+
+async def warm_up_query_cache(item_types: Iterable[str], templates: Iterable[str] = QUERY_TEMPLATES):
+    """Заранее кодирует запросы для фиксированных типов вещей одним батчем."""
+    texts = [template.format(item) for item in item_types for template in templates]
+    vectors = await asyncio.gather(*(encoder.encode(text) for text in texts))
+    for text, vec in zip(texts, vectors):
+        query_cache.put(text, vec, pinned=True)
+    logging.info(f"✅ Прогрето эмбеддингов запросов: {len(texts)}")
+
+async def warm_up(item_types: Iterable[str]):
+    """Фоновый прогрев: загрузка модели в потоке encoder и кэш запросов."""
+    try:
+        await warm_up_query_cache(item_types)
+    except Exception as e:
+        logging.error(f"Ошибка прогрева модели: {e}")
+
+class SearchCursor:
+    """Ранжированный список id одной выдачи, по которому листают страницы."""
+    __slots__ = ("token", "ad_ids", "expires")
+
+    def __init__(self, token: str, ad_ids: List[int], expires: float):
+        self.token = token
+        self.ad_ids = ad_ids
+        self.expires = expires
+
+
+class CursorStore:
+    """
+    Курсоры выдачи поиска: по одному на пользователя, живут ttl секунд.
+    Следующая страница — это срез готового списка id, без повторного ранжирования.
+    """
+
+    def __init__(self, ttl: float = SEARCH_CURSOR_TTL, max_size: int = SEARCH_CURSOR_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cursors: OrderedDict = OrderedDict()  # user_id → SearchCursor
+
+    def create(self, user_id: int, ad_ids: List[int]) -> SearchCursor:
+        cursor = SearchCursor(secrets.token_hex(4), list(ad_ids), time.monotonic() + self.ttl)
+        self._cursors.pop(user_id, None)
+        self._cursors[user_id] = cursor
+        while len(self._cursors) > self.max_size:
+            self._cursors.popitem(last=False)
+        return cursor
+
+    def get(self, user_id: int, token: str) -> Optional[SearchCursor]:
+        cursor = self._cursors.get(user_id)
+        if cursor is None or cursor.token != token:
+            return None
+        if cursor.expires < time.monotonic():
+            del self._cursors[user_id]
+            return None
+        return cursor
+
+
+search_cursors = CursorStore()
+
+def fuse_scores(cosine: np.ndarray, bm25: np.ndarray, text_weight: float = HYBRID_TEXT_WEIGHT) -> np.ndarray:
+    """
+    Взвешенная сумма косинуса и BM25. bm25 из SQLite тем лучше, чем меньше,
+    поэтому он разворачивается и нормируется в [0, 1] по выдаче.
+    """
+    text = -np.asarray(bm25, dtype=np.float32)
+    span = text.max() - text.min()
+    text = (text - text.min()) / span if span > 0 else np.ones_like(text)
+    return (1 - text_weight) * cosine + text_weight * text
+
+@timed(inference_seconds)
+def hybrid_rank(
+    query_embedding: np.ndarray,
+    text_hits: List[Tuple[int, float]],
+    k: Optional[int] = None,
+    location_key: Optional[str] = None
+) -> List[Tuple[int, float]]:
+    """
+    text_hits: [(ad_id, bm25), ...] из полнотекстового поиска.
+    Косинус считается только для этого шорт-листа; возвращает [(ad_id, score), ...].
+    """
+    if not text_hits:
+        return []
+    bm25 = dict(text_hits)
+    ids, cosine = ad_index.score_ids(query_embedding, bm25.keys())
+    if not len(ids):
+        return []
+    fused = fuse_scores(cosine, np.array([bm25[int(ad_id)] for ad_id in ids]))
+    if location_key:
+        bias = location_bias(location_key)
+        fused += np.array([bias.get(ad_index.key_of(int(ad_id))[1], 0.0) for ad_id in ids], dtype=np.float32)
+    return [(int(ids[i]), float(fused[i])) for i in top_k(fused, k)]
 
-def rank_ads_by_query(query_embedding: np.ndarray, ads_with_embeddings: list) -> list:
+def search_nearby(
+    query_embedding: np.ndarray,
+    item_type: str,
+    location_key: Optional[str] = None,
+    k: Optional[int] = None
+) -> List[Tuple[int, float]]:
     """
-    ads_with_embeddings: список кортежей (ad_row, embedding)
-    Возвращает: [(ad_row, similarity), ...], отсортировано по убыванию
+    Векторный поиск с учётом здания: кандидаты из своего и соседних корпусов,
+    к косинусу добавляется надбавка за близость (см. locations.py).
+    Без корпуса — по всем корпусам, только по сходству.
     """
-    scored = []
-    for ad, emb in ads_with_embeddings:
-        sim = cosine_similarity(query_embedding, emb)
-        scored.append((ad, sim))
-    return sorted(scored, key=lambda x: x[1], reverse=True)
\ No newline at end of file
+    if not location_key:
+        return ad_index.search(query_embedding, item_type, None, k)
+    bias = {(item_type, loc): b for loc, b in location_bias(location_key).items()}
+    return ad_index.search_keys(query_embedding, bias.keys(), k, bias)
@@ -0,0 +1,191 @@
+"""
+Планировщик исходящих сообщений с учётом лимитов Telegram.
+
+Обработчики кладут сообщения в очередь и не ждут каждый round-trip к
+Bot API. На каждый чат — своя очередь и свой token bucket, поверх — общий
+bucket на весь бот. Подряд идущие сообщения в один чат склеиваются в одно,
+если помещаются в лимит длины, а ответ 429 (retry_after) откладывает
+очередь этого чата вместо ошибки.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+MAX_MESSAGE_LENGTH = 4096
+GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 25))   # сообщений в секунду на бота
+CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))        # сообщений в секунду в один чат
+CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", 3))
+MAX_RETRIES = 3
+MAX_IDLE_BUCKETS = 10000
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self) -> float:
+        """Сколько ждать до свободного токена (0 — можно сразу)."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class _Outgoing:
+    __slots__ = ("text", "kwargs", "futures")
+
+    def __init__(self, text: str, kwargs: Dict[str, Any], future: asyncio.Future):
+        self.text = text
+        self.kwargs = kwargs
+        self.futures = [future]
+
+    def can_absorb(self, other: "_Outgoing") -> bool:
+        """Можно ли дописать other в это сообщение: клавиатура — только у последнего."""
+        if self.kwargs.get("reply_markup") is not None:
+            return False
+        mine = {k: v for k, v in self.kwargs.items() if k != "reply_markup"}
+        theirs = {k: v for k, v in other.kwargs.items() if k != "reply_markup"}
+        return mine == theirs and len(self.text) + 2 + len(other.text) <= MAX_MESSAGE_LENGTH
+
+    def absorb(self, other: "_Outgoing"):
+        self.text = f"{self.text}\n\n{other.text}"
+        self.kwargs["reply_markup"] = other.kwargs.get("reply_markup")
+        self.futures.extend(other.futures)
+
+
+class OutboundScheduler:
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        chat_burst: int = CHAT_BURST,
+        max_retries: int = MAX_RETRIES
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, Deque[_Outgoing]] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def send(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """
+        Ставит сообщение в очередь чата и сразу возвращает future с
+        отправленным Message. Ждать его не обязательно: ошибки логируются.
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+        queue.append(_Outgoing(text, kwargs, future))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return future
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, bucket: TokenBucket):
+        while True:
+            wait = max(bucket.delay(), self._global.delay())
+            if wait <= 0:
+                bucket.take()
+                self._global.take()
+                return
+            await asyncio.sleep(wait)
+
+    def _next_batch(self, queue: Deque[_Outgoing]) -> _Outgoing:
+        item = queue.popleft()
+        while queue and item.can_absorb(queue[0]):
+            item.absorb(queue.popleft())
+        return item
+
+    async def _drain(self, chat_id: int):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                await self._deliver(chat_id, self._next_batch(queue))
+        finally:
+            del self._workers[chat_id]
+            if not queue:
+                del self._queues[chat_id]
+            if len(self._buckets) > MAX_IDLE_BUCKETS:
+                self._prune_buckets()
+
+    def _prune_buckets(self):
+        """Убирает bucket'ы простаивающих чатов, которые уже полностью восполнились."""
+        for chat_id, bucket in list(self._buckets.items()):
+            if chat_id not in self._queues and bucket.delay() == 0 and bucket.tokens >= bucket.capacity:
+                del self._buckets[chat_id]
+
+    async def _deliver(self, chat_id: int, item: _Outgoing):
+        bucket = self._bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(bucket)
+            try:
+                result = await self.bot.send_message(chat_id, item.text, **item.kwargs)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    self._fail(item, e)
+                    return
+                backoff = max(float(e.retry_after), 2 ** attempt)
+                logging.warning(f"429 для чата {chat_id}, ждём {backoff} с")
+                bucket.block(backoff)
+                continue
+            except Exception as e:
+                self._fail(item, e)
+                return
+            for future in item.futures:
+                if not future.done():
+                    future.set_result(result)
+            return
+
+    def _fail(self, item: _Outgoing, error: Exception):
+        logging.error(f"Не удалось отправить сообщение: {error}")
+        for future in item.futures:
+            if not future.done():
+                future.set_exception(error)
+                future.exception()  # помечаем как обработанное — никто может не ждать
+
+    async def flush(self, timeout: Optional[float] = None):
+        """Дожидается отправки всего, что уже в очередях."""
+        workers: List[asyncio.Task] = list(self._workers.values())
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+
+    async def close(self, timeout: float = 5.0):
+        await self.flush(timeout)
+        for task in list(self._workers.values()):
+            task.cancel()
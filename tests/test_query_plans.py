@@ -0,0 +1,48 @@
+"""
+Планы горячих запросов (database.HOT_QUERIES) на свежей схеме: ни один не
+должен проходить таблицу или индекс целиком.
+"""
+import asyncio
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "db", database.Database(str(tmp_path / "plans.db")))
+    return database.db
+
+
+def run(coro):
+    async def wrapper():
+        try:
+            await database.init_db()
+            return await coro()
+        finally:
+            await database.close_db()
+    return asyncio.run(wrapper())
+
+
+def test_hot_queries_use_indexes(fresh_db):
+    assert run(database.check_query_plans) == []
+
+
+def test_index_walk_without_constraint_is_reported(fresh_db):
+    async def drop_and_check():
+        async with database.db.write() as conn:
+            await conn.execute("DROP INDEX idx_ads_loc_created")
+        return await database.check_query_plans()
+
+    problems = run(drop_and_check)
+    assert any(p.startswith("admin: страница по корпусу:") and "USING INDEX" in p for p in problems)
+
+
+def test_aliases_are_resolved():
+    sql = "SELECT a.id FROM ads_fts JOIN ads a ON a.id = ads_fts.rowid"
+    assert database.full_scan("SCAN a", sql, {"ads", "ads_fts"}) == "ads"
+    assert database.full_scan("SCAN a USING INDEX idx_ads_created", sql, {"ads"}) == "ads"
+    assert database.full_scan("SEARCH a USING INTEGER PRIMARY KEY (rowid=?)", sql, {"ads"}) is None
+    assert database.full_scan("SCAN ads_fts VIRTUAL TABLE INDEX 0:M2", sql, {"ads_fts"}) is None
+    assert database.full_scan("SCAN (subquery-1)", sql, {"ads"}) is None
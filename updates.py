@@ -0,0 +1,116 @@
+"""
+Планировщик входящих апдейтов: параллельно между чатами, по порядку внутри чата.
+
+Регистрируется outer-middleware на dp.update и работает одинаково для
+вебхука и polling: апдейт ставится в очередь своего чата, и запрос
+вебхука (или цикл getUpdates) сразу освобождается. Одновременно
+обрабатывается не больше UPDATE_CONCURRENCY апдейтов, а если в работе уже
+UPDATE_MAX_PENDING, приём ждёт — Telegram при этом сам притормаживает
+доставку. Повторы одного update_id (Telegram переотправляет апдейт, если
+вебхук ответил не сразу) отбрасываются.
+"""
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 32))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", 1000))
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", 10000))
+
+Handler = Callable[[Update, Dict[str, Any]], Awaitable[Any]]
+
+
+class UpdateScheduler(BaseMiddleware):
+    def __init__(
+        self,
+        max_concurrency: int = UPDATE_CONCURRENCY,
+        max_pending: int = UPDATE_MAX_PENDING,
+        dedup_size: int = UPDATE_DEDUP_SIZE
+    ):
+        self.max_pending = max_pending
+        self.dedup_size = dedup_size
+        self.duplicates = 0
+        self.in_flight = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._capacity = asyncio.Semaphore(max_pending)
+        self._seen: OrderedDict = OrderedDict()  # последние update_id
+        self._queues: Dict[Hashable, Deque[Tuple[Handler, Update, Dict[str, Any]]]] = {}
+        self._workers: Dict[Hashable, asyncio.Task] = {}
+
+    def _is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            self.duplicates += 1
+            return True
+        self._seen[update_id] = None
+        if len(self._seen) > self.dedup_size:
+            self._seen.popitem(last=False)
+        return False
+
+    @staticmethod
+    def _chat_key(event: Update, data: Dict[str, Any]) -> Hashable:
+        chat = data.get("event_chat")
+        if chat is not None:
+            return chat.id
+        user = data.get("event_from_user")
+        if user is not None:
+            return ("user", user.id)
+        return ("update", event.update_id)  # без чата — порядок не важен
+
+    async def __call__(self, handler: Handler, event: Update, data: Dict[str, Any]) -> Any:
+        if self._is_duplicate(event.update_id):
+            return None
+        await self._capacity.acquire()  # backpressure
+        self.in_flight += 1
+        key = self._chat_key(event, data)
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        queue.append((handler, event, data))
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return None
+
+    async def _drain(self, key: Hashable):
+        queue = self._queues[key]
+        try:
+            while queue:
+                handler, event, data = queue.popleft()
+                try:
+                    async with self._slots:
+                        await self._process(handler, event, data)
+                except Exception:
+                    logging.exception(f"Ошибка обработки апдейта {event.update_id}")
+                finally:
+                    self.in_flight -= 1
+                    self._capacity.release()
+        finally:
+            del self._workers[key]
+            if not queue:
+                del self._queues[key]
+
+    async def _process(self, handler: Handler, event: Update, data: Dict[str, Any]):
+        # FSM-middleware прочитал состояние ещё при постановке в очередь;
+        # к этому моменту предыдущий апдейт чата мог его поменять
+        state = data.get("state")
+        if state is not None:
+            data["raw_state"] = await state.get_state()
+        result = await handler(event, data)
+        if isinstance(result, TelegramMethod):
+            await data["bot"](result)
+
+    async def flush(self, timeout: Optional[float] = None):
+        """Дожидается обработки всего, что уже принято."""
+        workers: List[asyncio.Task] = list(self._workers.values())
+        if workers:
+            await asyncio.wait(workers, timeout=timeout)
+
+    async def close(self, timeout: float = 10.0):
+        await self.flush(timeout)
+        for task in list(self._workers.values()):
+            task.cancel()
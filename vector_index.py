@@ -0,0 +1,205 @@
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metrics import inference_seconds, timed
+
+PartitionKey = Tuple[str, str]  # (item_type, location_key)
+
+
+def normalize(vec: np.ndarray) -> np.ndarray:
+    """Приводит вектор к единичной длине (float32)."""
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+def top_k(scores: np.ndarray, k: Optional[int]) -> np.ndarray:
+    """Индексы k лучших оценок по убыванию: argpartition + сортировка только k штук."""
+    n = len(scores)
+    if k is None or k >= n:
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class _Partition:
+    """Непрерывная матрица нормированных векторов одной пары (тип, локация)."""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.matrix = np.empty((capacity, dim), dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+        self.rows: Dict[int, int] = {}  # ad_id → строка матрицы
+
+    def add(self, ad_id: int, vec: np.ndarray):
+        if ad_id in self.rows:
+            self.matrix[self.rows[ad_id]] = vec
+            return
+        if self.size == len(self.ids):
+            capacity = len(self.ids) * 2
+            self.matrix = np.resize(self.matrix, (capacity, self.matrix.shape[1]))
+            self.ids = np.resize(self.ids, capacity)
+        self.matrix[self.size] = vec
+        self.ids[self.size] = ad_id
+        self.rows[ad_id] = self.size
+        self.size += 1
+
+    def remove(self, ad_id: int):
+        row = self.rows.pop(ad_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            # Переносим последнюю строку на место удалённой
+            self.matrix[row] = self.matrix[last]
+            moved_id = int(self.ids[last])
+            self.ids[row] = moved_id
+            self.rows[moved_id] = row
+        self.size = last
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        return self.matrix[:self.size] @ query
+
+
+class AdIndex:
+    """
+    Резидентный индекс эмбеддингов активных объявлений.
+
+    Векторы хранятся нормированными, поэтому косинусная близость — это одно
+    умножение матрицы на вектор. Индекс заполняется из таблицы ads при старте
+    и дальше обновляется на месте из create_ad / archive_ad; разделы, изменённые
+    другими процессами, перечитываются целиком (database.sync_result_cache).
+    """
+
+    def __init__(self):
+        self.dim: Optional[int] = None
+        self.loaded = False
+        self._partitions: Dict[PartitionKey, _Partition] = {}
+        self._keys: Dict[int, PartitionKey] = {}  # ad_id → партиция
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, ad_id: int) -> bool:
+        return ad_id in self._keys
+
+    def clear(self):
+        self.dim = None
+        self.loaded = False
+        self._partitions.clear()
+        self._keys.clear()
+
+    def add(self, ad_id: int, item_type: str, location_key: str, embedding: np.ndarray):
+        vec = normalize(embedding)
+        if self.dim is None:
+            self.dim = vec.shape[0]
+        elif vec.shape[0] != self.dim:
+            raise ValueError(f"Размерность {vec.shape[0]} не совпадает с индексом ({self.dim})")
+        key = (item_type, location_key)
+        old_key = self._keys.get(ad_id)
+        if old_key is not None and old_key != key:
+            self._partitions[old_key].remove(ad_id)
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition(self.dim)
+        partition.add(ad_id, vec)
+        self._keys[ad_id] = key
+
+    def remove(self, ad_id: int):
+        key = self._keys.pop(ad_id, None)
+        if key is not None:
+            self._partitions[key].remove(ad_id)
+
+    def replace_partition(self, item_type: str, location_key: str, rows: Iterable[Tuple[int, np.ndarray]]):
+        """Заменяет партицию целиком — когда её изменил другой процесс и она перечитана из БД."""
+        old = self._partitions.pop((item_type, location_key), None)
+        if old is not None:
+            for ad_id in old.rows:
+                del self._keys[ad_id]
+        for ad_id, embedding in rows:
+            self.add(ad_id, item_type, location_key, embedding)
+
+    @timed(inference_seconds, "ad_index_search")
+    def search(
+        self,
+        query_embedding: np.ndarray,
+        item_type: str,
+        location_key: Optional[str] = None,
+        k: Optional[int] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Возвращает [(ad_id, similarity), ...] по убыванию близости.
+        Без location_key ищет по всем локациям данного типа.
+        """
+        if location_key:
+            keys = [(item_type, location_key)]
+        else:
+            keys = [key for key in self._partitions if key[0] == item_type]
+        return self.search_keys(query_embedding, keys, k)
+
+    def search_keys(
+        self,
+        query_embedding: np.ndarray,
+        keys: Iterable[PartitionKey],
+        k: Optional[int] = None,
+        bias: Optional[Dict[PartitionKey, float]] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        Как search, но по явному списку партиций (item_type, location_key).
+        bias — надбавка к близости для всей партиции (например, за близость корпуса).
+        """
+        keys = [key for key in keys if key in self._partitions and self._partitions[key].size]
+        if not keys:
+            return []
+
+        query = normalize(query_embedding)
+        chunks = []
+        for key in keys:
+            scores = self._partitions[key].scores(query)
+            if bias and bias.get(key):
+                scores = scores + bias[key]
+            chunks.append(scores)
+        if len(keys) == 1:
+            scores = chunks[0]
+            ids = self._partitions[keys[0]].ids[:self._partitions[keys[0]].size]
+        else:
+            scores = np.concatenate(chunks)
+            ids = np.concatenate([self._partitions[key].ids[:self._partitions[key].size] for key in keys])
+        order = top_k(scores, k)
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+    def key_of(self, ad_id: int) -> Optional[PartitionKey]:
+        return self._keys.get(ad_id)
+
+    def score_ids(self, query_embedding: np.ndarray, ad_ids: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, близость) только для указанных объявлений; отсутствующие в индексе пропускаются."""
+        found, rows = [], []
+        for ad_id in ad_ids:
+            key = self._keys.get(ad_id)
+            if key is None:
+                continue
+            partition = self._partitions[key]
+            found.append(ad_id)
+            rows.append(partition.matrix[partition.rows[ad_id]])
+        if not found:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.array(found, dtype=np.int64), np.stack(rows) @ normalize(query_embedding)
+
+    def partition_matrix(self, keys: Iterable[PartitionKey]) -> Tuple[np.ndarray, np.ndarray]:
+        """Склеенные (ids, матрица векторов) указанных партиций — для пакетного скоринга."""
+        partitions = [self._partitions.get(key) for key in keys]
+        partitions = [p for p in partitions if p is not None and p.size]
+        if not partitions:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dim or 0), dtype=np.float32)
+        if len(partitions) == 1:
+            p = partitions[0]
+            return p.ids[:p.size], p.matrix[:p.size]
+        return (
+            np.concatenate([p.ids[:p.size] for p in partitions]),
+            np.concatenate([p.matrix[:p.size] for p in partitions]),
+        )
+
+
+ad_index = AdIndex()